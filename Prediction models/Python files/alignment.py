@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Time alignment of the station readings.
+#
+# The predictor used to blend the last row of every sheet as it was, so a
+# reading from an hour ago had the same weight as one from a few seconds ago,
+# and stations read one after another were never put on a common time. The
+# aligner keeps a short buffer of timestamped readings per station and joins
+# them to one cycle timestamp:
+#
+#   - as-of join: every station contributes its latest reading at or before
+#     the cycle time,
+#   - optional linear interpolation of the numerical parameters between the
+#     readings just before and just after the cycle time (use a small lag so
+#     the cycle time falls between readings),
+#   - readings older than max_age are dropped, or kept with a weight that
+#     halves every half_life seconds past max_age.
+#
+# Adding a reading is a deque append, O(1); aligning a cycle looks at the last
+# reading of every station (or a few more when the cycle time lies in the past).
+
+from collections import deque
+
+from idw_engine import NUMERIC_PARAMS
+from storage import parse_timestamp
+
+# Readings kept per station
+BUFFER_SIZE = 16
+
+# What happens to readings older than max_age
+STALE_POLICIES = ('drop', 'downweight')
+
+# Readings up to this many seconds after the cycle time count as current, so
+# a small clock difference between the sheets and this machine is harmless
+CLOCK_SKEW = 60
+
+
+# Function to get the timestamp of a sheet record from its Date and Time cells.
+# Returns None when they cannot be read.
+def record_time(record):
+    if not record:
+        return None
+    timestamp = parse_timestamp(record.get('Date', ''), record.get('Time', ''))
+    return None if timestamp != timestamp else timestamp
+
+
+# Function to get the weight of a reading of the given age
+def stale_weight(age, max_age, half_life):
+    if max_age is None or age <= max_age:
+        return 1.0
+    return 0.5 ** ((age - max_age) / half_life)
+
+
+class AsOfAligner:
+    def __init__(self, max_age=None, stale_policy='drop', half_life=None, interpolate=False, buffer_size=BUFFER_SIZE):
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"stale_policy must be one of {', '.join(STALE_POLICIES)}")
+        self.max_age = max_age
+        self.stale_policy = stale_policy
+        self.half_life = half_life or max_age
+        self.interpolate = interpolate
+        self.buffer_size = buffer_size
+        self.buffers = {}  # station -> deque of (timestamp, reading), oldest first
+
+    # Function to add a reading; readings older than the last one of the station are ignored
+    def add(self, name, timestamp, reading):
+        if timestamp is None:
+            return False
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            buffer = self.buffers[name] = deque(maxlen=self.buffer_size)
+        if buffer and timestamp < buffer[-1][0]:
+            return False
+        if buffer and timestamp == buffer[-1][0]:
+            buffer.pop()
+        buffer.append((timestamp, reading))
+        return True
+
+    # Function to get the age of the latest reading of a station at a moment in time
+    def age(self, name, at_time):
+        buffer = self.buffers.get(name)
+        return at_time - buffer[-1][0] if buffer else None
+
+    # Function to find the readings just before (or at) and just after the cycle time
+    def _bracket(self, buffer, cycle_time):
+        after = None
+        for timestamp, reading in reversed(buffer):
+            if timestamp <= cycle_time:
+                return (timestamp, reading), after
+            after = (timestamp, reading)
+        return None, after
+
+    # Function to join every station to the cycle time.
+    # Returns (data, weights, ages): the aligned reading of every usable
+    # station, its weight (only below 1 for down-weighted readings) and the
+    # age in seconds of the reading it is based on.
+    def align(self, cycle_time, names=None):
+        data, weights, ages = {}, {}, {}
+        for name in (names if names is not None else self.buffers):
+            buffer = self.buffers.get(name)
+            if not buffer:
+                continue
+            before, after = self._bracket(buffer, cycle_time)
+            if before is None:
+                if after is None or after[0] - cycle_time > CLOCK_SKEW:
+                    continue
+                before, after = (cycle_time, after[1]), None
+            timestamp, reading = before
+            age = cycle_time - timestamp
+
+            if self.interpolate and after is not None and after[0] > timestamp:
+                # Linear interpolation in time of the numerical parameters
+                fraction = (cycle_time - timestamp) / (after[0] - timestamp)
+                reading = dict(reading)
+                for param in NUMERIC_PARAMS:
+                    reading[param] = reading[param] + fraction * (after[1][param] - reading[param])
+                age = min(age, after[0] - cycle_time)
+
+            if self.max_age is not None and age > self.max_age and self.stale_policy == 'drop':
+                continue
+            data[name] = reading
+            weights[name] = stale_weight(age, self.max_age, self.half_life) if self.max_age is not None else 1.0
+            ages[name] = age
+        return data, weights, ages
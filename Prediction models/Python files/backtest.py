@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Offline backtest against the Reference Node.
+#
+# Plots/Curve.ipynb compared a prediction CSV with the Reference Node CSV row
+# by row, after cutting both to the same length, once per 2/3/4-node case.
+# This script replays the station history kept in the local store instead:
+#
+#   1. every Reference Node reading is joined, by time, to the latest reading
+#      of every station at that moment (as-of join, readings older than
+#      --tolerance seconds are ignored),
+#   2. the IDW prediction at the Reference Node is recomputed for any number of
+#      station subsets with the weights of idw_engine,
+#   3. the error of every subset is summarised per parameter: MAE, RMSE, bias,
+#      the mean relative error (%) of Curve.ipynb and the number of points.
+#
+# Each subset's estimate at every reference time is a matrix product, so whole
+# blocks of subsets are evaluated at once and the blocks are spread over a
+# process pool. Every subset of a 20-station deployment (about a million
+# subsets) takes minutes.
+#
+#     python storage.py import data "Reference Node" "Reference Node.csv"
+#     python backtest.py --lat 7.0195 --lon 79.9002 --reference "Reference Node" --all-subsets --min-size 2
+#     python backtest.py --lat 7.0195 --lon 79.9002 --subsets "WS1,WS2;WS1,WS2,WS4;WS1,WS2,WS3,WS4"
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+
+from idw_engine import NUMERIC_PARAMS, haversine_matrix, idw_weights
+
+# Seconds a station reading stays usable for the as-of join
+DEFAULT_TOLERANCE = 120
+
+# Subsets x reference times evaluated per block, to bound memory
+BLOCK_CELLS = 4_000_000
+
+# Summary statistics reported per parameter
+METRICS = ['mae', 'rmse', 'bias', 'relative_error', 'points']
+
+# Shared by the worker processes, set once per process by _init_worker
+_replay = None
+
+
+# Function to join every reference time to the latest reading of each station.
+# Returns (values, valid): values has shape (times, stations, params) and valid
+# marks the readings that exist, are recent enough and are not NaN.
+def align_as_of(reference_times, station_series, tolerance=DEFAULT_TOLERANCE, params=NUMERIC_PARAMS):
+    reference_times = np.asarray(reference_times, dtype=float)
+    values = np.zeros((len(reference_times), len(station_series), len(params)))
+    valid = np.zeros(values.shape, dtype=bool)
+
+    for s, series in enumerate(station_series):
+        timestamps = np.asarray(series['timestamp'], dtype=float)
+        if len(timestamps) == 0:
+            continue
+        latest = np.searchsorted(timestamps, reference_times, side='right') - 1
+        fresh = (latest >= 0) & (reference_times - timestamps[np.maximum(latest, 0)] <= tolerance)
+        for i, param in enumerate(params):
+            column = np.asarray(series[param], dtype=float)[np.maximum(latest, 0)]
+            ok = fresh & np.isfinite(column)
+            values[:, s, i] = np.where(ok, column, 0.0)
+            valid[:, s, i] = ok
+    return values, valid
+
+
+# Function to turn subsets (lists of station positions) into a 0/1 matrix
+def subset_matrix(subsets, station_count):
+    matrix = np.zeros((len(subsets), station_count))
+    for row, subset in enumerate(subsets):
+        matrix[row, list(subset)] = 1.0
+    return matrix
+
+
+# Function to list every subset of the stations with at least min_size members
+def all_subsets(station_count, min_size=1, max_size=None):
+    max_size = station_count if max_size is None else max_size
+    return [subset for size in range(min_size, max_size + 1)
+            for subset in combinations(range(station_count), size)]
+
+
+# Function to compute the IDW estimates of a block of subsets at every
+# reference time. weights are the raw IDW weights of the stations at the
+# Reference Node; only the stations of a subset with a valid reading count,
+# like the live predictor. Returns (subsets, params, times), NaN where no
+# station of the subset had a reading.
+def estimate_subsets(masks, weights, values, valid, decimals=2):
+    subset_weights = masks * weights[None, :]
+    estimates = np.empty((len(masks), values.shape[2], values.shape[0]))
+    for i in range(values.shape[2]):
+        present = valid[:, :, i].astype(float)
+        numerator = subset_weights @ (present * values[:, :, i]).T
+        denominator = subset_weights @ present.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(numerator, denominator, out=estimates[:, i, :])
+        estimates[:, i, :][denominator == 0] = np.nan
+    return np.round(estimates, decimals, out=estimates) if decimals is not None else estimates
+
+
+# Function to summarise the error of every subset, per parameter.
+# estimates has shape (subsets, params, times) and reference (times, params).
+# Returns an array of shape (subsets, params, len(METRICS)).
+def error_metrics(estimates, reference):
+    reference = np.asarray(reference, dtype=float).T
+    errors = estimates - reference[None]
+    missing = np.isnan(errors)
+    points = errors.shape[2] - missing.sum(axis=2)
+    errors[missing] = 0.0
+    absolute = np.abs(errors)
+
+    # Relative error as in Curve.ipynb, |actual - predicted| / |actual| * 100
+    with np.errstate(divide='ignore'):
+        inverse = np.where(np.isfinite(reference) & (reference != 0), 1.0 / np.abs(reference), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.stack([
+            absolute.sum(axis=2) / points,
+            np.sqrt(np.einsum('kpt,kpt->kp', errors, errors) / points),
+            errors.sum(axis=2) / points,
+            np.einsum('kpt,pt->kp', absolute, inverse) * 100 / points,
+            points,
+        ], axis=-1)
+
+
+def _init_worker(replay):
+    global _replay
+    _replay = replay
+
+
+# Function run in the worker processes: evaluate one block of subsets
+def _evaluate_block(subsets):
+    weights, values, valid, reference = _replay
+    masks = subset_matrix(subsets, len(weights))
+    return error_metrics(estimate_subsets(masks, weights, values, valid), reference)
+
+
+# Function to replay the history through every subset, block by block on a process pool.
+# reference has shape (times, params). Returns (subsets, params, len(METRICS)).
+def evaluate_subsets(subsets, weights, values, valid, reference, workers=None):
+    block = max(1, BLOCK_CELLS // max(len(reference), 1))
+    blocks = [subsets[start:start + block] for start in range(0, len(subsets), block)]
+    replay = (weights, values, valid, reference)
+    if workers == 1 or len(blocks) == 1:
+        _init_worker(replay)
+        results = [_evaluate_block(subset_block) for subset_block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(replay,)) as pool:
+            results = list(pool.map(_evaluate_block, blocks))
+    return np.concatenate(results) if results else np.empty((0, len(NUMERIC_PARAMS), len(METRICS)))
+
+
+# Function to read the station and Reference Node history from the local store
+def load_history(backend, registry, reference_sheet, start=None, end=None):
+    names = registry.names()
+    reference = backend.scan(reference_sheet, start, end, fields=NUMERIC_PARAMS)
+    # Readings slightly before the first reference time are needed for the as-of join
+    series = [backend.scan(registry.stations[name].get('sheet', name), None, end, fields=NUMERIC_PARAMS) for name in names]
+    return names, reference, series
+
+
+# Function to write one CSV row per subset with its metrics
+def write_results(path, names, subsets, metrics):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(['Stations', 'Size'] + [f"{param} {metric}" for param in NUMERIC_PARAMS for metric in METRICS])
+        for subset, row in zip(subsets, metrics):
+            writer.writerow([",".join(names[i] for i in subset), len(subset)] +
+                            [f"{value:.6g}" for value in row.ravel()])
+
+
+# Function to read a --start/--end time such as "2025-04-18 13:00:00"
+def parse_time_arg(text):
+    from storage import parse_timestamp
+
+    date_str, _, time_str = text.strip().partition(" ")
+    timestamp = parse_timestamp(date_str, time_str)
+    if timestamp != timestamp:
+        raise argparse.ArgumentTypeError(f"cannot read the time {text!r}, use 'YYYY-mm-dd HH:MM:SS'")
+    return timestamp
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest IDW predictions against the Reference Node.")
+    parser.add_argument("--config", help="station config file (JSON)")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store")
+    parser.add_argument("--reference", default="Reference Node", help="sheet of the Reference Node in the local store")
+    parser.add_argument("--lat", type=float, required=True, help="latitude of the Reference Node")
+    parser.add_argument("--lon", type=float, required=True, help="longitude of the Reference Node")
+    parser.add_argument("--start", type=parse_time_arg, help="first reference time, 'YYYY-mm-dd HH:MM:SS'")
+    parser.add_argument("--end", type=parse_time_arg, help="last reference time, 'YYYY-mm-dd HH:MM:SS'")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="seconds a station reading stays usable")
+    parser.add_argument("--subsets", help="station subsets to evaluate, e.g. 'WS1,WS2;WS1,WS2,WS4'")
+    parser.add_argument("--all-subsets", action="store_true", help="evaluate every subset of the stations")
+    parser.add_argument("--min-size", type=int, default=1, help="smallest subset with --all-subsets")
+    parser.add_argument("--max-size", type=int, help="largest subset with --all-subsets")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--out", default="backtest.csv", help="CSV file for the per-subset metrics")
+    parser.add_argument("--top", type=int, default=10, help="number of best subsets to print")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from predictor import DEFAULT_CONFIG, StationRegistry
+    from storage import LocalBackend
+
+    args = parse_args(argv)
+    registry = StationRegistry.from_config(args.config or DEFAULT_CONFIG)
+    backend = LocalBackend(args.data_dir)
+    names, reference, series = load_history(backend, registry, args.reference, args.start, args.end)
+    if len(reference['timestamp']) == 0:
+        print(f"No Reference Node readings in {os.path.join(args.data_dir, args.reference)}")
+        return
+
+    if args.subsets:
+        position = {name: i for i, name in enumerate(names)}
+        subsets = [tuple(position[name.strip()] for name in group.split(",")) for group in args.subsets.split(";")]
+    elif args.all_subsets:
+        subsets = all_subsets(len(names), args.min_size, args.max_size)
+    else:
+        subsets = [tuple(range(len(names)))]
+
+    started = time.perf_counter()
+    values, valid = align_as_of(reference['timestamp'], series, args.tolerance)
+    reference_values = np.column_stack([reference[param] for param in NUMERIC_PARAMS])
+    distances = haversine_matrix([args.lat], [args.lon],
+                                 [registry.stations[name]['latitude'] for name in names],
+                                 [registry.stations[name]['longitude'] for name in names])
+    weights = idw_weights(distances, registry.power)[0]
+    metrics = evaluate_subsets(subsets, weights, values, valid, reference_values, args.workers)
+    elapsed = time.perf_counter() - started
+
+    write_results(args.out, names, subsets, metrics)
+    print(f"Evaluated {len(subsets)} subsets over {len(reference_values)} reference readings "
+          f"in {elapsed:.1f} s, results in {args.out}")
+
+    # Best subsets by mean relative error over the numerical parameters
+    score = np.nanmean(metrics[:, :, METRICS.index('relative_error')], axis=1)
+    for rank, i in enumerate(np.argsort(np.where(np.isfinite(score), score, np.inf))[:args.top], 1):
+        errors = ", ".join(f"{param}: {metrics[i, p, METRICS.index('relative_error')]:.2f}%"
+                           for p, param in enumerate(NUMERIC_PARAMS))
+        print(f"{rank:>3}. {','.join(names[s] for s in subsets[i])} - {errors}")
+
+
+if __name__ == "__main__":
+    main()
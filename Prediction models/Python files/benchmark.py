@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmarks of the prediction pipeline on synthetic data.
+#
+# Every stage that grows with the number of stations or targets is timed on
+# generated fixtures, from the 4 stations of the experiments up to 10,000
+# stations and 1,000,000 targets:
+#
+#   distance     haversine_matrix, every target to every station
+#   idw          predict_numeric, a full IDW pass from the coordinates
+#   idw_cached   IDWWeightCache.predict with one station changed since the last cycle
+#   categorical  IDWWeightCache.vote_codes (weighted vote, weights cached)
+#   neighbors    idw_neighbors_estimate over the 8 nearest stations (StationIndex)
+#   receiver     payload_to_record + parse_station_entry, one payload at a time
+#   receiver_bulk parse_receiver_strings on the whole batch of payloads
+#   fetch        one poll of every station through StationFetcher and
+#                SheetTailReader, against FakeSheetsBackend
+#
+# Payloads come from receiver_payloads(), which writes strings the way the
+# receiver node sends them ("WS1, 28.1C, 70.2%, 1008.5hPa, Good, Not raining").
+# FakeSheetsBackend is an in-process stand-in for Google Sheets: each station
+# sheet grows at --rate rows per second, and every API call takes --latency
+# seconds and fails with probability --error-rate.
+#
+# Each case reports its throughput (items per second at the median time), its
+# latency percentiles and its peak memory (tracemalloc). Timings only compare
+# on the machine that made them, so baselines are saved per machine
+# (bench_baselines-<host>.json, not committed). Every run shows the change
+# against this machine's baseline; with --check it exits with status 1 when a
+# case got slower or bigger than the baseline by more than --tolerance.
+# The dense cases (distance, idw, categorical) are skipped above
+# DENSE_MAX_CELLS stations x targets; neighbors covers those sizes.
+#
+#     python benchmark.py                                 # quick profile
+#     python benchmark.py --profile full                  # 4..10,000 stations, 1..1,000,000 targets
+#     python benchmark.py --bench idw,fetch --latency 0.05
+#     python benchmark.py --save-baseline                 # store this run as this machine's baseline
+#     python benchmark.py --check                         # fail on regressions against it
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from bulk_parser import parse_receiver_strings
+from idw_engine import IDWWeightCache, CategoryEncoder, haversine_matrix, predict_numeric
+from ingest_server import payload_to_record
+from metrics import METRICS
+from sheet_tail import SheetTailReader
+from spatial_index import StationIndex, idw_neighbors_estimate
+from station_fetch import StationFetcher, parse_station_entry
+from storage import WS_EXPECTED_HEADERS, PD_EXPECTED_HEADERS, StorageBackend
+
+# Sizes of each profile: station counts, target counts and receiver payloads
+PROFILES = {
+    'quick': {'stations': [4, 100, 1000], 'targets': [1, 1000, 100_000], 'payloads': 10_000},
+    'full': {'stations': [4, 100, 1000, 10_000], 'targets': [1, 1000, 100_000, 1_000_000], 'payloads': 1_000_000},
+}
+BENCHMARKS = ['distance', 'idw', 'idw_cached', 'categorical', 'neighbors', 'receiver', 'receiver_bulk', 'fetch']
+
+# Largest stations x targets matrix built by the dense cases
+DENSE_MAX_CELLS = 10_000_000
+
+# Neighbours used by the neighbors case
+NEIGHBORS = 8
+
+# Centre and half-width (degrees) of the synthetic city
+CENTER = (7.0195, 79.9002)
+SPREAD = 0.05
+
+# Each case runs at least MIN_REPEAT times and for at least MIN_TIME seconds,
+# but never more than MAX_REPEAT times
+MIN_REPEAT = 5
+MIN_TIME = 0.5
+MAX_REPEAT = 1000
+
+# Relative slowdown (or memory growth) reported as a regression, and the
+# absolute differences below which a change is treated as noise
+TOLERANCE = 0.25
+NOISE_MS = 0.05
+NOISE_MB = 0.1
+
+# Baselines of this machine
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             f"bench_baselines-{platform.node() or 'local'}.json")
+
+AIR_QUALITY = ['Good', 'Moderate', 'Poor']
+RAIN_STATUS = ['Not raining', 'Light rain', 'Raining']
+LOCAL_TZ = pytz.timezone("Asia/Colombo")
+
+
+# Function to generate a station registry ({name: {latitude, longitude, sheet}})
+def synthetic_stations(count, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = CENTER[0] + rng.uniform(-SPREAD, SPREAD, count)
+    lon = CENTER[1] + rng.uniform(-SPREAD, SPREAD, count)
+    return {f"WS{i + 1}": {'latitude': float(lat[i]), 'longitude': float(lon[i]), 'sheet': f"WS{i + 1}"}
+            for i in range(count)}
+
+
+# Function to generate one parsed reading per station
+def synthetic_readings(stations, seed=0):
+    rng = np.random.default_rng(seed)
+    count = len(stations)
+    temperature = np.round(rng.uniform(24, 34, count), 2)
+    humidity = np.round(rng.uniform(50, 95, count), 2)
+    pressure = np.round(rng.uniform(1000, 1015, count), 2)
+    air_quality = rng.choice(AIR_QUALITY, count)
+    rain_status = rng.choice(RAIN_STATUS, count)
+    return {name: {'Temperature': temperature[i], 'Humidity': humidity[i], 'Air Pressure': pressure[i],
+                   'Air Quality': str(air_quality[i]), 'Rain Status': str(rain_status[i])}
+            for i, name in enumerate(stations)}
+
+
+# Function to generate target points as an array of (latitude, longitude)
+def synthetic_targets(count, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([CENTER[0] + rng.uniform(-SPREAD, SPREAD, count),
+                            CENTER[1] + rng.uniform(-SPREAD, SPREAD, count)])
+
+
+# Function to generate receiver payloads, cycling over the station names.
+# A fraction error_rate of the temperatures is "Error", like a failed sensor.
+def receiver_payloads(names, count, error_rate=0.001, seed=0):
+    rng = np.random.default_rng(seed)
+    names = list(names)
+    for i in range(count):
+        temperature = "Error" if rng.random() < error_rate else f"{rng.uniform(24, 34):.1f}C"
+        yield (f"{names[i % len(names)]}, {temperature}, {rng.uniform(50, 95):.1f}%, "
+               f"{rng.uniform(1000, 1015):.1f}hPa, {AIR_QUALITY[rng.integers(3)]}, {RAIN_STATUS[rng.integers(3)]}")
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def fetch_sheet_metadata(self):
+        sheet = self.worksheet
+        sheet._call()
+        return {'sheets': [{'properties': {'sheetId': sheet.id, 'title': sheet.title,
+                                           'gridProperties': {'rowCount': sheet.row_count, 'columnCount': sheet.col_count}}}]}
+
+
+class FakeWorksheet:
+    # In-process stand-in for gspread.Worksheet. The sheet holds `history`
+    # rows when created and grows by `rate` rows per second; rows are made up
+    # from their index, so nothing is stored. Every call sleeps `latency`
+    # seconds and raises ConnectionError with probability error_rate.
+    GRID_MARGIN = 100
+
+    def __init__(self, title, header, rate=1.0, history=1000, latency=0.0, error_rate=0.0, seed=0):
+        self.title = title
+        self.id = 0
+        self.header = header
+        self.rate = rate
+        self.history = history
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed)
+        self.created = time.monotonic()
+        self.start = datetime(2025, 5, 1)
+        self.spreadsheet = FakeSpreadsheet(self)
+        self.appended = []
+
+    # Function to simulate the round trip and the failures of an API call
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise ConnectionError(f"simulated failure reading {self.title}")
+
+    @property
+    def rows(self):
+        return self.history + int((time.monotonic() - self.created) * self.rate) + len(self.appended)
+
+    @property
+    def row_count(self):
+        return self.rows + 1 + self.GRID_MARGIN
+
+    @property
+    def col_count(self):
+        return len(self.header)
+
+    # Function to make up data row `index` (0-based)
+    def _row(self, index):
+        generated = self.rows - len(self.appended)
+        if index >= generated:
+            return list(self.appended[index - generated])
+        stamp = self.start + timedelta(seconds=index / self.rate if self.rate else index)
+        wave = math.sin(index / 50)
+        return [stamp.strftime("%Y-%m-%d"), stamp.strftime("%H:%M:%S"), f"{29 + 3 * wave:.2f}C",
+                f"{72 - 10 * wave:.2f}%", f"{1008 + wave:.2f}hPa", AIR_QUALITY[index % 3], RAIN_STATUS[index // 7 % 3]]
+
+    # Function to get the cells of sheet row `row` (1 is the header)
+    def _sheet_row(self, row):
+        if row == 1:
+            return list(self.header)
+        if 2 <= row <= self.rows + 1:
+            return self._row(row - 2)
+        return []
+
+    def row_values(self, row):
+        self._call()
+        return self._sheet_row(row)
+
+    # Function to read "A<first>:<col>" (open-ended) or "A<first>:<col><last>"
+    def get(self, range_name):
+        self._call()
+        start, _, end = range_name.partition(":")
+        first = int(start[1:])
+        digits = ''.join(c for c in end if c.isdigit())
+        last = min(int(digits), self.rows + 1) if digits else self.rows + 1
+        return [self._sheet_row(row) for row in range(first, last + 1)]
+
+    def batch_get(self, ranges):
+        self._call()
+        results = []
+        for cell in ranges:
+            row = self._sheet_row(int(cell[1:]))
+            results.append([[row[0]]] if row else [])
+        return results
+
+    def get_all_records(self, expected_headers=None):
+        self._call()
+        return [dict(zip(self.header, self._row(i))) for i in range(self.rows)]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        self.appended.extend(values)
+
+
+class FakeSheetsBackend(StorageBackend):
+    # Station and prediction sheets served from memory at configurable rates
+    def __init__(self, rate=1.0, history=1000, latency=0.0, error_rate=0.0):
+        self.rate = rate
+        self.history = history
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sheets = {}
+
+    def _sheet(self, sheet_name, header, history):
+        if sheet_name not in self.sheets:
+            self.sheets[sheet_name] = FakeWorksheet(sheet_name, header, self.rate, history, self.latency,
+                                                    self.error_rate, seed=len(self.sheets))
+        return self.sheets[sheet_name]
+
+    def open_station(self, name, info):
+        return self._sheet(info.get('sheet', name), WS_EXPECTED_HEADERS, self.history)
+
+    def open_predictions(self, sheet_name):
+        return self._sheet(sheet_name, PD_EXPECTED_HEADERS, 0)
+
+
+# Function to time a function: one warm-up call, then repeated calls.
+# Returns the list of call times in seconds and the peak traced memory in bytes.
+def measure(fn, min_repeat=MIN_REPEAT, min_time=MIN_TIME, max_repeat=MAX_REPEAT):
+    fn()
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_repeat and (len(times) < min_repeat or time.perf_counter() - start < min_time):
+        begin = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - begin)
+
+    # Memory is traced in a separate call, as tracing slows every allocation down
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+# Function to summarize the call times of a case processing `items` items per call
+def summarize(items, times, peak):
+    ms = np.asarray(times) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'items': items, 'runs': len(times), 'throughput': round(items / (p50 / 1000), 1) if p50 > 0 else None,
+            'p50_ms': round(float(p50), 4), 'p90_ms': round(float(p90), 4), 'p99_ms': round(float(p99), 4),
+            'peak_mb': round(peak / 2 ** 20, 3)}
+
+
+# Function to build the case functions of one station and target count.
+# Returns (name, items per call, function) for every case that fits.
+def spatial_cases(benches, station_count, target_count):
+    stations = synthetic_stations(station_count)
+    latest_data = synthetic_readings(stations)
+    targets = synthetic_targets(target_count)
+    size = f"stations={station_count}/targets={target_count}"
+    dense = station_count * target_count <= DENSE_MAX_CELLS
+    cases = []
+
+    if 'distance' in benches and dense:
+        lat = [info['latitude'] for info in stations.values()]
+        lon = [info['longitude'] for info in stations.values()]
+        cases.append((f"distance/{size}", target_count,
+                      lambda: haversine_matrix(targets[:, 0], targets[:, 1], lat, lon)))
+
+    if 'idw' in benches and dense:
+        cases.append((f"idw/{size}", target_count, lambda: predict_numeric(stations, latest_data, targets, 2)))
+
+    if 'idw_cached' in benches and dense:
+        cache = IDWWeightCache()
+        first = next(iter(latest_data))
+        data = {name: dict(reading) for name, reading in latest_data.items()}
+
+        def idw_cached():
+            data[first]['Temperature'] += 0.01
+            return cache.predict(stations, data, targets, 2)
+        cases.append((f"idw_cached/{size}", target_count, idw_cached))
+
+    if 'categorical' in benches and dense:
+        cache = IDWWeightCache()
+        encoder = CategoryEncoder(AIR_QUALITY)
+        cases.append((f"categorical/{size}", target_count,
+                      lambda: cache.vote_codes(stations, latest_data, targets, 2, 'Air Quality', encoder)))
+
+    if 'neighbors' in benches:
+        index = StationIndex.from_stations(stations)
+        values = np.array([[latest_data[name][param] for param in ('Temperature', 'Humidity', 'Air Pressure')]
+                           for name in index.names])
+        cases.append((f"neighbors/{size}", target_count,
+                      lambda: idw_neighbors_estimate(index, targets, values, 2, k=min(NEIGHBORS, station_count))))
+    return cases
+
+
+# Function to build the receiver payload cases
+def receiver_cases(benches, count):
+    payloads = list(receiver_payloads([f"WS{i + 1}" for i in range(4)], count))
+    cases = []
+
+    if 'receiver' in benches:
+        def receiver():
+            parsed = 0
+            for payload in payloads:
+                try:
+                    parse_station_entry(payload_to_record(payload.split(",", 1)[1], LOCAL_TZ))
+                    parsed += 1
+                except ValueError:
+                    pass
+            return parsed
+        cases.append((f"receiver/payloads={count}", count, receiver))
+
+    if 'receiver_bulk' in benches:
+        cases.append((f"receiver_bulk/payloads={count}", count, lambda: parse_receiver_strings(payloads)))
+    return cases
+
+
+# Function to build the fetch case of one station count
+def fetch_case(station_count, rate, latency, error_rate, workers):
+    stations = synthetic_stations(station_count)
+    backend = FakeSheetsBackend(rate=rate, latency=latency, error_rate=error_rate)
+    sheets = {name: backend.open_station(name, info) for name, info in stations.items()}
+    reader = SheetTailReader()
+    fetcher = StationFetcher(lambda sheet: reader.read_latest(sheet, WS_EXPECTED_HEADERS), max_workers=workers)
+
+    def fetch():
+        latest_data = {}
+        fetcher.fetch_missing(sheets, latest_data)
+        return latest_data
+    return f"fetch/stations={station_count}", station_count, fetch, fetcher
+
+
+# Function to compare results with the baselines.
+# Returns the list of regressions as (case, what, baseline, now).
+def compare(results, baselines, tolerance=TOLERANCE):
+    regressions = []
+    for case, result in results.items():
+        baseline = baselines.get(case)
+        if baseline is None:
+            continue
+        if result['p50_ms'] > baseline['p50_ms'] * (1 + tolerance) and result['p50_ms'] - baseline['p50_ms'] > NOISE_MS:
+            regressions.append((case, 'p50_ms', baseline['p50_ms'], result['p50_ms']))
+        if result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance) and result['peak_mb'] - baseline['peak_mb'] > NOISE_MB:
+            regressions.append((case, 'peak_mb', baseline['peak_mb'], result['peak_mb']))
+    return regressions
+
+
+# Function to print one result line, with the change against the baseline
+def report(case, result, baseline=None):
+    change = ""
+    if baseline:
+        change = f"  ({result['p50_ms'] / baseline['p50_ms'] - 1:+.0%} vs baseline)" if baseline['p50_ms'] else ""
+    throughput = f"{result['throughput']:,.0f}/s" if result['throughput'] else "-"
+    print(f"{case:<48} {throughput:>16} p50 {result['p50_ms']:>10.3f} ms  p90 {result['p90_ms']:>10.3f} ms  "
+          f"p99 {result['p99_ms']:>10.3f} ms  peak {result['peak_mb']:>9.2f} MB{change}", flush=True)
+
+
+# Function to load the stored baselines ({case: result})
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get('results', {})
+    except (OSError, ValueError):
+        return {}
+
+
+# Function to store results as the baselines, keeping the cases not run this time
+def save_baselines(path, results):
+    baselines = load_baselines(path)
+    baselines.update(results)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({'saved': datetime.now().isoformat(timespec='seconds'),
+                   'machine': f"{platform.node()} {platform.machine()} Python {platform.python_version()}",
+                   'results': dict(sorted(baselines.items()))}, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def parse_list(text, cast=int):
+    return [cast(item) for item in text.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prediction pipeline on synthetic data.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick", help="sizes to run (default: quick)")
+    parser.add_argument("--stations", type=parse_list, help="station counts, e.g. 4,100,10000 (overrides the profile)")
+    parser.add_argument("--targets", type=parse_list, help="target counts, e.g. 1,1000 (overrides the profile)")
+    parser.add_argument("--payloads", type=int, help="receiver payloads per run (overrides the profile)")
+    parser.add_argument("--bench", type=lambda text: parse_list(text, str), default=BENCHMARKS,
+                        help=f"cases to run, from {','.join(BENCHMARKS)}")
+    parser.add_argument("--rate", type=float, default=1.0, help="rows appended per second to every fake sheet")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake Sheets API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake Sheets API calls that fail")
+    parser.add_argument("--workers", type=int, default=8, help="fetch worker threads")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help=f"baseline file (default: {os.path.basename(BASELINE_FILE)})")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown or memory growth reported as a regression (default: 0.25)")
+    parser.add_argument("--out", help="also write the results of this run to a JSON file")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.bench if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = PROFILES[args.profile]
+    station_counts = args.stations or profile['stations']
+    target_counts = args.targets or profile['targets']
+    payload_count = args.payloads or profile['payloads']
+    baselines = load_baselines(args.baseline)
+    results = {}
+
+    def run(case, items, fn):
+        results[case] = summarize(items, *measure(fn))
+        report(case, results[case], baselines.get(case))
+
+    for station_count in station_counts:
+        for target_count in target_counts:
+            for case, items, fn in spatial_cases(args.bench, station_count, target_count):
+                run(case, items, fn)
+
+    for case, items, fn in receiver_cases(args.bench, payload_count):
+        run(case, items, fn)
+
+    if 'fetch' in args.bench:
+        # The fetch path records metrics per sheet; clear them so thousands of
+        # fake sheets do not pile up in the registry
+        for station_count in station_counts:
+            case, items, fn, fetcher = fetch_case(station_count, args.rate, args.latency, args.error_rate, args.workers)
+            try:
+                run(case, items, fn)
+            finally:
+                fetcher.close()
+                METRICS.histograms.clear()
+                METRICS.counters.clear()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        save_baselines(args.baseline, results)
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return 0
+
+    if not baselines:
+        print(f"No baselines in {args.baseline}; run with --save-baseline to store them")
+        return 1 if args.check else 0
+    regressions = compare(results, baselines, args.tolerance)
+    for case, what, before, now in regressions:
+        print(f"{'REGRESSION' if args.check else 'Slower than baseline'} {case}: {what} {before} -> {now}")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
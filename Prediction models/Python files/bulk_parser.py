@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Bulk parser for station history.
+#
+# parse_station_entry() reads one record at a time with float(...replace())
+# and raises on the first odd cell, which throws the whole cycle away. To
+# backfill or replay months of history, the functions here turn many sheet
+# rows or receiver strings at once into one compact NumPy structured array:
+#
+#   timestamp     datetime64[s]  Date + Time of the row (NaT if unreadable)
+#   temperature   float32        degrees C   (NaN if unreadable)
+#   humidity      float32        %           (NaN if unreadable)
+#   pressure      float32        hPa         (NaN if unreadable)
+#   air_quality   int8           AIR_QUALITY_CODES   (-1 if unreadable)
+#   rain_status   int8           RAIN_STATUS_CODES   (-1 if unreadable)
+#   valid         uint8          one bit per field above, set when the cell parsed
+#
+# Columns are converted in one NumPy call each. The "Error" token WSx.ino
+# sends when a sensor fails and empty cells are masked on that fast path; only
+# a column with some other unreadable cell falls back to cell-by-cell parsing.
+# Bad cells are masked instead of aborting the batch.
+#
+#     python bulk_parser.py --rows 1000000    # throughput benchmark
+
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Integer codes of the categorical values sent by the transmitters (WSx.ino)
+AIR_QUALITY_CODES = {'Good': 0, 'Moderate': 1, 'Poor': 2}
+RAIN_STATUS_CODES = {'Not raining': 0, 'Light rain': 1, 'Raining': 2}
+MISSING_CODE = -1
+
+# Code table of every categorical parameter, shared with idw_engine.CategoryEncoder
+# and the local store so codes mean the same everywhere
+CATEGORY_CODES = {'Air Quality': AIR_QUALITY_CODES, 'Rain Status': RAIN_STATUS_CODES}
+
+READING_DTYPE = np.dtype([
+    ('timestamp', 'datetime64[s]'),
+    ('temperature', np.float32),
+    ('humidity', np.float32),
+    ('pressure', np.float32),
+    ('air_quality', np.int8),
+    ('rain_status', np.int8),
+    ('valid', np.uint8),
+])
+
+# Bit of each field in the 'valid' column
+VALID_BITS = {'timestamp': 1, 'temperature': 2, 'humidity': 4, 'pressure': 8, 'air_quality': 16, 'rain_status': 32}
+
+# Sheet column -> (array field, unit suffix)
+NUMERIC_COLUMNS = {'Temperature': ('temperature', 'C'), 'Humidity': ('humidity', '%'), 'Air Pressure': ('pressure', 'hPa')}
+CATEGORY_COLUMNS = {'Air Quality': ('air_quality', AIR_QUALITY_CODES), 'Rain Status': ('rain_status', RAIN_STATUS_CODES)}
+
+# Formats tried, in order, for Date + Time cells, shared with storage.parse_timestamp
+# (CSV exports of the sheets may use 12-hour times such as "1:49:58 PM")
+TIMESTAMP_FORMATS = ["%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%Y/%m/%d %H:%M:%S",
+                     "%Y-%m-%d %I:%M:%S %p", "%m/%d/%Y %I:%M:%S %p", "%d/%m/%Y %I:%M:%S %p", "%Y-%m-%d %H:%M"]
+
+
+# Function to parse a column of numbers with an optional unit suffix.
+# Returns (values, valid mask).
+def parse_numeric_column(cells, unit=''):
+    text = np.char.strip(np.asarray(cells, dtype=str))
+    if unit:
+        text = np.where(np.char.endswith(text, unit), np.char.replace(text, unit, ''), text)
+    # Known bad tokens become NaN without leaving the fast path
+    text = np.where((text == 'Error') | (text == ''), 'nan', text)
+    try:
+        values = text.astype(np.float64)
+        return values, np.isfinite(values)
+    except ValueError:
+        pass
+
+    # Slow path, only for columns with bad cells
+    values = np.full(len(text), np.nan)
+    for i, cell in enumerate(text):
+        try:
+            values[i] = float(cell)
+        except ValueError:
+            pass
+    return values, np.isfinite(values)
+
+
+# Function to turn a column of category names into integer codes.
+# Only the distinct values are looked up, which are a handful per column.
+def parse_category_column(cells, codes):
+    text = np.char.strip(np.asarray(cells, dtype=str))
+    if len(text) == 0:
+        return np.empty(0, dtype=np.int8), np.empty(0, dtype=bool)
+    uniques, inverse = np.unique(text, return_inverse=True)
+    lookup = np.array([codes.get(value, MISSING_CODE) for value in uniques], dtype=np.int8)
+    values = lookup[inverse.reshape(-1)]
+    return values, values != MISSING_CODE
+
+
+# Function to turn Date and Time columns into datetime64 values
+def parse_timestamp_column(dates, times):
+    text = np.char.strip(np.char.add(np.char.add(np.char.strip(np.asarray(dates, dtype=str)), ' '),
+                                     np.char.strip(np.asarray(times, dtype=str))))
+    try:
+        values = np.char.replace(text, ' ', 'T', count=1).astype('datetime64[s]')
+        return values, ~np.isnat(values)
+    except ValueError:
+        pass
+
+    values = np.full(len(text), np.datetime64('NaT'), dtype='datetime64[s]')
+    # A CSV export uses one format throughout, so first look for a format that
+    # reads nearly every row (one strptime per row); this also reads ambiguous
+    # dates such as 4/5/2025 the same way in every row of the column.
+    rest = range(len(text))
+    for fmt in TIMESTAMP_FORMATS:
+        parsed = _strptime_all(text, fmt, max_failures=len(text) // 100 + 1)
+        if parsed is not None:
+            values[:], rest = parsed
+            break
+
+    # Rows the column format could not read: the first format that reads the cell
+    for i in rest:
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                values[i] = np.datetime64(datetime.strptime(text[i], fmt), 's')
+                break
+            except ValueError:
+                continue
+    return values, ~np.isnat(values)
+
+
+# Function to read every "date time" cell with one format. The date and the
+# time are parsed once per distinct value, so a long history costs at most a
+# few thousand strptime calls. Returns (datetime64 values with NaT where the
+# format failed, indices of those cells), or None once more than
+# max_failures cells have failed.
+def _strptime_all(text, fmt, max_failures):
+    date_fmt, time_fmt = fmt.split(' ', 1)
+    parts = np.char.partition(text, ' ')
+    failures = 0
+
+    dates, date_index = np.unique(parts[:, 0], return_inverse=True)
+    date_counts = np.bincount(date_index.reshape(-1), minlength=len(dates))
+    days = np.full(len(dates), np.datetime64('NaT'), dtype='datetime64[D]')
+    for i, cell in enumerate(dates):
+        try:
+            days[i] = np.datetime64(datetime.strptime(cell, date_fmt).date())
+        except ValueError:
+            failures += date_counts[i]
+            if failures > max_failures:
+                return None
+
+    times, time_index = np.unique(parts[:, 2], return_inverse=True)
+    time_counts = np.bincount(time_index.reshape(-1), minlength=len(times))
+    seconds = np.full(len(times), -1, dtype=np.int64)
+    for i, cell in enumerate(times):
+        try:
+            moment = datetime.strptime(cell, time_fmt)
+            seconds[i] = moment.hour * 3600 + moment.minute * 60 + moment.second
+        except ValueError:
+            failures += time_counts[i]
+            if failures > max_failures:
+                return None
+
+    values = days[date_index.reshape(-1)].astype('datetime64[s]') + seconds[time_index.reshape(-1)].astype('timedelta64[s]')
+    failed = np.isnat(values) | (seconds[time_index.reshape(-1)] < 0)
+    values[failed] = np.datetime64('NaT')
+    return values, np.flatnonzero(failed)
+
+
+# Function to build the structured array from parsed columns
+def build_readings(columns, count):
+    readings = np.zeros(count, dtype=READING_DTYPE)
+    valid = np.zeros(count, dtype=np.uint8)
+
+    if 'Date' in columns and 'Time' in columns:
+        readings['timestamp'], ok = parse_timestamp_column(columns['Date'], columns['Time'])
+        valid |= np.where(ok, VALID_BITS['timestamp'], 0).astype(np.uint8)
+    else:
+        readings['timestamp'] = np.datetime64('NaT')
+
+    for column, (field, unit) in NUMERIC_COLUMNS.items():
+        values, ok = parse_numeric_column(columns.get(column, [''] * count), unit)
+        readings[field] = values
+        valid |= np.where(ok, VALID_BITS[field], 0).astype(np.uint8)
+
+    for column, (field, codes) in CATEGORY_COLUMNS.items():
+        values, ok = parse_category_column(columns.get(column, [''] * count), codes)
+        readings[field] = values
+        valid |= np.where(ok, VALID_BITS[field], 0).astype(np.uint8)
+
+    readings['valid'] = valid
+    return readings
+
+
+# Function to parse sheet rows, given as lists of cells in header order or as
+# records (dicts keyed by the sheet headers)
+def parse_sheet_rows(rows, header=None):
+    rows = list(rows)
+    if not rows:
+        return np.zeros(0, dtype=READING_DTYPE)
+    if isinstance(rows[0], dict):
+        header = list(rows[0])
+        rows = [[record.get(name, '') for name in header] for record in rows]
+    if header is None:
+        from storage import WS_EXPECTED_HEADERS
+        header = WS_EXPECTED_HEADERS
+
+    width = len(header)
+    if set(map(len, rows)) != {width}:
+        rows = [list(row[:width]) + [''] * (width - len(row)) for row in rows]
+    table = np.array(rows, dtype=str)  # one C-level conversion for the whole batch
+    columns = {name: table[:, i] for i, name in enumerate(header)}
+    return build_readings(columns, len(rows))
+
+
+# Function to parse receiver strings such as "WS1, 28.50C, 70.00%, 1008.00hPa, Good, Not raining".
+# The station prefix is optional (R.ino strips it before sending). Returns
+# (readings, station names); receiver strings carry no date, so the
+# timestamps are NaT unless received_at (one datetime64 per string) is given.
+def parse_receiver_strings(payloads, received_at=None):
+    payloads = list(payloads)
+    names = ['Temperature', 'Humidity', 'Air Pressure', 'Air Quality', 'Rain Status']
+    commas = np.char.count(np.asarray(payloads, dtype=str), ',') if payloads else np.zeros(0, dtype=int)
+
+    if len(payloads) and (np.all(commas == 5) or np.all(commas == 4)):
+        # Fast path: every string has the same shape, so one split covers the batch
+        width = int(commas[0]) + 1
+        table = np.array(",".join(payloads).split(","), dtype=str).reshape(len(payloads), width)
+        stations = np.char.strip(table[:, 0]) if width == 6 else np.full(len(payloads), '')
+        columns = {name: table[:, width - 5 + i] for i, name in enumerate(names)}
+    else:
+        stations = []
+        fields = []
+        for payload in payloads:
+            parts = [part.strip() for part in payload.split(',')]
+            if len(parts) == 6:
+                stations.append(parts[0])
+                parts = parts[1:]
+            else:
+                stations.append('')
+            fields.append((parts + [''] * 5)[:5])
+        columns = dict(zip(names, zip(*fields) if fields else [[]] * 5))
+
+    readings = build_readings(columns, len(payloads))
+    if received_at is not None:
+        readings['timestamp'] = np.asarray(received_at, dtype='datetime64[s]')
+        readings['valid'] |= np.where(~np.isnat(readings['timestamp']), VALID_BITS['timestamp'], 0).astype(np.uint8)
+    return readings, np.array(stations)
+
+
+# Function to get the mask of rows where every given field parsed
+def valid_mask(readings, fields=tuple(VALID_BITS)):
+    bits = sum(VALID_BITS[field] for field in fields)
+    return (readings['valid'] & bits) == bits
+
+
+# Function to generate synthetic sheet rows for the benchmark, with a few "Error" cells
+def synthetic_rows(count, error_rate=0.001, seed=0):
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(count) * 5
+    stamps = (np.datetime64('2025-05-01T00:00:00') + seconds.astype('timedelta64[s]')).astype(str)
+    temperature = np.char.add(np.round(rng.uniform(24, 34, count), 2).astype(str), 'C')
+    humidity = np.char.add(np.round(rng.uniform(50, 95, count), 2).astype(str), '%')
+    pressure = np.char.add(np.round(rng.uniform(1000, 1015, count), 2).astype(str), 'hPa')
+    air_quality = rng.choice(list(AIR_QUALITY_CODES), count)
+    rain_status = rng.choice(list(RAIN_STATUS_CODES), count)
+
+    errors = rng.random(count) < error_rate
+    temperature = np.where(errors, 'Error', temperature)
+    rows = [[stamp[:10], stamp[11:], t, h, p, a, r]
+            for stamp, t, h, p, a, r in zip(stamps, temperature, humidity, pressure, air_quality, rain_status)]
+    payloads = [f"WS1, {t}, {h}, {p}, {a}, {r}" for t, h, p, a, r in
+                zip(temperature, humidity, pressure, air_quality, rain_status)]
+    return rows, payloads
+
+
+# Function to measure the parsing throughput in rows per second
+def benchmark(count):
+    rows, payloads = synthetic_rows(count)
+
+    start = time.perf_counter()
+    readings = parse_sheet_rows(rows)
+    sheet_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse_receiver_strings(payloads)
+    receiver_seconds = time.perf_counter() - start
+
+    print(f"Parsed {count} sheet rows in {sheet_seconds:.2f} s ({count / sheet_seconds:,.0f} rows/s), "
+          f"{np.count_nonzero(~valid_mask(readings))} rows with masked cells")
+    print(f"Parsed {count} receiver strings in {receiver_seconds:.2f} s ({count / receiver_seconds:,.0f} rows/s)")
+    print(f"Structured array: {readings.nbytes / count:.0f} bytes per row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bulk station record parser.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    benchmark(parser.parse_args().rows)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Short-term forecasts per station.
+#
+# IDW only interpolates the readings in space, for now. HoltForecaster keeps a
+# level and a trend for every station and numerical parameter (Holt's linear
+# exponential smoothing) and updates them with each new reading in constant
+# time and memory. The forecasts of every station at a horizon (+5, +15 and
+# +60 minutes by default) are then interpolated to the targets with the same
+# IDW weights as the current readings.
+#
+# Readings do not arrive at a fixed interval, so the smoothing factors are
+# scaled to the time since the station's previous reading, and the trend is
+# damped so long horizons do not run away with a short-lived slope.
+
+import numpy as np
+
+from idw_engine import NUMERIC_PARAMS
+from scheduler import DEFAULT_CADENCE
+
+# Forecast horizons in minutes
+FORECAST_HORIZONS = (5, 15, 60)
+
+# Smoothing of the level and the trend per DEFAULT_CADENCE seconds, and the
+# trend damping per DEFAULT_CADENCE seconds
+ALPHA = 0.5
+BETA = 0.1
+PHI = 0.98
+
+# Physical limits of the forecasts
+LIMITS = {'Humidity': (0.0, 100.0)}
+
+
+class HoltForecaster:
+    def __init__(self, names, params=NUMERIC_PARAMS, alpha=ALPHA, beta=BETA, phi=PHI, step=DEFAULT_CADENCE):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.params = list(params)
+        self.alpha = alpha
+        self.beta = beta
+        self.phi = phi
+        self.step = step
+
+        shape = (len(self.names), len(self.params))
+        self.level = np.full(shape, np.nan)
+        self.trend = np.zeros(shape)                      # per second
+        self.last_time = np.full(len(self.names), np.nan)
+
+    # Function to add a reading of a station; readings older than the last one are ignored
+    def update(self, name, timestamp, reading):
+        i = self.index.get(name)
+        if i is None or timestamp is None:
+            return False
+        values = np.array([reading.get(param, np.nan) for param in self.params], dtype=float)
+        seen = np.isfinite(values)
+
+        if np.isnan(self.last_time[i]):
+            self.level[i] = values
+            self.last_time[i] = timestamp
+            return True
+        dt = timestamp - self.last_time[i]
+        if dt <= 0:
+            return False
+
+        # Smoothing factors for a gap of dt seconds instead of one step
+        steps = dt / self.step
+        alpha = 1 - (1 - self.alpha) ** steps
+        beta = 1 - (1 - self.beta) ** steps
+        level, trend = self.level[i], self.trend[i] * self.phi ** steps
+        expected = level + trend * dt
+
+        started = seen & np.isnan(level)                  # first valid value of a parameter
+        update = seen & ~started
+        new_level = np.where(update, alpha * values + (1 - alpha) * expected, np.where(started, values, expected))
+        self.trend[i] = np.where(update, beta * (new_level - level) / dt + (1 - beta) * trend, trend)
+        self.level[i] = new_level
+        self.last_time[i] = timestamp
+        return True
+
+    # Function to forecast every station and parameter at a moment in time.
+    # Returns an array of shape (stations, params); NaN for stations without data.
+    def forecast(self, at_time):
+        dt = np.maximum(at_time - self.last_time, 0)
+        steps = dt / self.step
+        if self.phi < 1:
+            # Sum of the damped trend over the steps ahead
+            horizon = self.step * self.phi * (1 - self.phi ** steps) / (1 - self.phi)
+        else:
+            horizon = dt
+        values = self.level + self.trend * horizon[:, None]
+        for j, param in enumerate(self.params):
+            if param in LIMITS:
+                values[:, j] = np.clip(values[:, j], *LIMITS[param])
+        return values
+
+
+# Function to interpolate station forecasts to the targets.
+# weights has shape (targets, stations) and values (stations, params); a
+# station without a forecast for a parameter is left out of that parameter.
+def interpolate_forecasts(weights, values):
+    known = np.isfinite(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights @ np.where(known, values, 0.0)) / (weights @ known)
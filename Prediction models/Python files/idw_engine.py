@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Batched IDW engine on NumPy arrays.
+#
+# The first prediction scripts computed the haversine distance, the IDW
+# estimate and the weighted category vote for one target, one station and one
+# parameter at a time. The functions here do the same maths for many targets
+# against many stations at once: a haversine distance matrix of shape
+# (targets, stations), the IDW estimates of every numerical parameter from a
+# single weight matrix, and a batched weighted vote for the categories.
+
+import numpy as np
+
+from bulk_parser import CATEGORY_CODES
+
+# Radius of the Earth in km
+EARTH_RADIUS_KM = 6371.0
+
+# Numerical parameters interpolated with IDW
+NUMERIC_PARAMS = ['Temperature', 'Humidity', 'Air Pressure']
+
+# Categorical parameters predicted by weighted voting
+CATEGORICAL_PARAMS = ['Air Quality', 'Rain Status']
+
+
+# Function to calculate the haversine distance from every target to every station
+def haversine_matrix(target_lat, target_lon, station_lat, station_lon):
+    target_lat = np.radians(np.asarray(target_lat, dtype=float))[:, None]
+    target_lon = np.radians(np.asarray(target_lon, dtype=float))[:, None]
+    station_lat = np.radians(np.asarray(station_lat, dtype=float))[None, :]
+    station_lon = np.radians(np.asarray(station_lon, dtype=float))[None, :]
+
+    dlat = target_lat - station_lat
+    dlon = target_lon - station_lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(station_lat) * np.cos(target_lat) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c  # Distance in km, shape (targets, stations)
+
+
+# Function to turn a distance matrix into raw IDW weights 1 / d**p.
+# A target that sits exactly on one or more stations takes their values only,
+# instead of dividing by zero.
+def idw_weights(distances, p):
+    distances = np.asarray(distances, dtype=float)
+    on_station = distances == 0
+    with np.errstate(divide='ignore'):
+        weights = 1.0 / distances ** p
+    exact_rows = on_station.any(axis=1)
+    if exact_rows.any():
+        weights[exact_rows] = on_station[exact_rows].astype(float)
+    return weights
+
+
+# Function to normalize weights so every row sums to one
+def normalize_weights(weights):
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+# Function to calculate the IDW estimate of every target.
+# values has shape (stations,) or (stations, params); the result has shape
+# (targets,) or (targets, params).
+def idw_estimate(distances, values, p, decimals=2):
+    weights = normalize_weights(idw_weights(distances, p))
+    estimates = weights @ np.asarray(values, dtype=float)
+    return np.round(estimates, decimals) if decimals is not None else estimates
+
+
+# Function to predict every numerical parameter for every target in one pass.
+# stations maps a station name to its coordinates, latest_data maps a station
+# name to its parsed reading and targets is an array of (latitude, longitude).
+def predict_numeric(stations, latest_data, targets, p, params=NUMERIC_PARAMS, decimals=2):
+    names = [name for name in stations if name in latest_data]
+    station_lat = [stations[name]['latitude'] for name in names]
+    station_lon = [stations[name]['longitude'] for name in names]
+    targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+
+    distances = haversine_matrix(targets[:, 0], targets[:, 1], station_lat, station_lon)
+    values = np.array([[latest_data[name][param] for param in params] for name in names], dtype=float)
+    estimates = idw_estimate(distances, values, p, decimals)
+    return {param: estimates[:, i] for i, param in enumerate(params)}
+
+
+class CategoryEncoder:
+    # Stable integer codes for the values of a categorical parameter. Codes
+    # are handed out in order of first appearance and never change, so
+    # readings can be encoded once and reused across cycles.
+    def __init__(self, categories=()):
+        self.codes = {}
+        self.categories = []
+        for category in categories:
+            self.encode(category)
+
+    # Function to build the encoder of a parameter, starting from its code
+    # table in bulk_parser so the codes match the bulk-parsed history and the
+    # local store; values outside the table get the next free codes
+    @classmethod
+    def for_param(cls, param):
+        codes = CATEGORY_CODES.get(param, {})
+        return cls(sorted(codes, key=codes.get))
+
+    def encode(self, category):
+        code = self.codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.codes[category] = code
+            self.categories.append(category)
+        return code
+
+    def encode_many(self, categories):
+        return np.array([self.encode(category) for category in categories], dtype=np.intp)
+
+    def decode(self, codes):
+        return [self.categories[code] for code in codes]
+
+
+# Function to pick the category with the largest summed weight for every target.
+# weights has shape (targets, stations) and codes holds the category code of
+# every station. The weights are summed in station order and ties go to the
+# category seen first in station order, exactly like the dict-based
+# max(weights, key=weights.get) of the original scripts.
+def weighted_vote(weights, codes):
+    codes = np.asarray(codes, dtype=np.intp)
+    weights = np.asarray(weights, dtype=float)
+
+    # Categories present, in order of first appearance among the stations
+    _, first_index = np.unique(codes, return_index=True)
+    order = codes[np.sort(first_index)]
+    slot = np.empty(codes.max() + 1, dtype=np.intp)
+    slot[order] = np.arange(len(order))
+
+    # Weighted bincount per target, one column per present category
+    scores = np.zeros((weights.shape[0], len(order)))
+    for station, column in enumerate(slot[codes]):
+        scores[:, column] += weights[:, station]
+
+    # np.argmax returns the first maximum, i.e. the earliest category on ties
+    return order[np.argmax(scores, axis=1)]
+
+
+# Number of weight matrices kept, so a station dropping in and out of a
+# cycle does not force a rebuild every time
+WEIGHT_CACHE_SIZE = 8
+
+# Number of delta updates after which the estimates are recomputed in full to
+# stop rounding errors from accumulating
+FULL_REFRESH_EVERY = 1000
+
+
+class IDWWeightCache:
+    # Station coordinates and target points do not change between cycles, so
+    # the weight matrix is built once per (station set, target set, power)
+    # and every refresh is a matrix product. The estimates and the votes of
+    # every parameter set share that matrix; each parameter set keeps its own
+    # values and estimates in the entry. When only some stations report new
+    # values, the estimates are corrected with those columns only.
+    def __init__(self, max_entries=WEIGHT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = {}  # key -> {'raw_weights', 'weights', 'params': {params -> {'values', 'estimates', 'updates'}}}
+
+    # Function to build the cache key of a station set, target set and power
+    def _key(self, names, stations, targets, p):
+        station_key = tuple((name, stations[name]['latitude'], stations[name]['longitude']) for name in names)
+        return station_key, targets.shape, targets.tobytes(), float(p)
+
+    # Function to get (or build) the cached entry of a station set, target set and power
+    def _entry(self, names, stations, targets, p):
+        key = self._key(names, stations, targets, p)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            distances = haversine_matrix(
+                targets[:, 0], targets[:, 1],
+                [stations[name]['latitude'] for name in names],
+                [stations[name]['longitude'] for name in names]
+            )
+            # The normalized weights are only built once an estimate needs them
+            entry = {'raw_weights': idw_weights(distances, p), 'weights': None, 'params': {}}
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]  # drop the least recently used
+        self.entries[key] = entry
+        return entry
+
+    # Function to update the estimates of every target from the latest readings.
+    # station_weights (name -> factor) scales the IDW weight of some stations,
+    # e.g. to down-weight stale readings; those estimates are not cached.
+    def estimate(self, stations, latest_data, targets, p, params=NUMERIC_PARAMS, station_weights=None):
+        names = [name for name in stations if name in latest_data]
+        targets = np.ascontiguousarray(targets, dtype=float).reshape(-1, 2)
+        entry = self._entry(names, stations, targets, p)
+
+        values = np.array([[latest_data[name][param] for param in params] for name in names], dtype=float)
+        factors = self._factors(names, station_weights)
+        if factors is not None:
+            return normalize_weights(entry['raw_weights'] * factors) @ values
+        if entry['weights'] is None:
+            entry['weights'] = normalize_weights(entry['raw_weights'])
+        weights = entry['weights']
+
+        state = entry['params'].setdefault(tuple(params), {'values': None, 'estimates': None, 'updates': 0})
+        if state['values'] is None or state['values'].shape != values.shape or state['updates'] >= FULL_REFRESH_EVERY:
+            state['estimates'] = weights @ values
+            state['updates'] = 0
+        else:
+            # Rank-k correction with the k stations whose values changed
+            changed = np.flatnonzero((values != state['values']).any(axis=1))
+            if changed.size:
+                state['estimates'] += weights[:, changed] @ (values[changed] - state['values'][changed])
+                state['updates'] += 1
+
+        state['values'] = values
+        return state['estimates']
+
+    # Function to get the weight factor of every station, or None when all are 1
+    def _factors(self, names, station_weights):
+        if not station_weights:
+            return None
+        factors = np.array([station_weights.get(name, 1.0) for name in names], dtype=float)
+        return None if np.all(factors == 1.0) else factors
+
+    # Function to predict every numerical parameter for every target
+    def predict(self, stations, latest_data, targets, p, params=NUMERIC_PARAMS, decimals=2, station_weights=None):
+        estimates = np.round(self.estimate(stations, latest_data, targets, p, params, station_weights), decimals)
+        return {param: estimates[:, i] for i, param in enumerate(params)}
+
+    # Function to predict a categorical parameter for every target by weighted voting.
+    # Returns the code (from encoder) of the winning category of every target.
+    def vote_codes(self, stations, latest_data, targets, p, param, encoder, station_weights=None):
+        names = [name for name in stations if name in latest_data]
+        codes = encoder.encode_many(latest_data[name][param] for name in names)
+        return weighted_vote(self.raw_weights(stations, latest_data, targets, p, station_weights), codes)
+
+    # Function to get the raw IDW weights of shape (targets, stations in latest_data),
+    # scaled by station_weights
+    def raw_weights(self, stations, latest_data, targets, p, station_weights=None):
+        names = [name for name in stations if name in latest_data]
+        targets = np.ascontiguousarray(targets, dtype=float).reshape(-1, 2)
+        entry = self._entry(names, stations, targets, p)
+        factors = self._factors(names, station_weights)
+        return entry['raw_weights'] if factors is None else entry['raw_weights'] * factors
+
+    # Function to predict a categorical parameter for every target by weighted voting.
+    # Returns the winning category of every target.
+    def vote(self, stations, latest_data, targets, p, param, encoder=None, station_weights=None):
+        encoder = encoder or CategoryEncoder.for_param(param)
+        return encoder.decode(self.vote_codes(stations, latest_data, targets, p, param, encoder, station_weights))
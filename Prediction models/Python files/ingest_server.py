@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# HTTP ingest server for the receiver node.
+#
+# R.ino sends every station reading to a Google Apps Script URL with
+#
+#     GET <url>?data=<url-encoded " 28.50C, 70.00%, 1008.00hPa, Good, Not raining">
+#
+# and the predictor then polls the sheets every 35 seconds. This server accepts
+# the same request directly, with the station name as the path
+# (http://<host>:8080/WS1?data=...), parses the reading into in-memory state
+# and recomputes the predictions as soon as it arrives. Point the
+# googleAppsScriptURL_WSx constants of R.ino at this server to use it; the
+# Apps Script then receives nothing, so every reading is also appended to the
+# station's sheet (--backend sheets) or local table (--backend local).
+#
+#     python ingest_server.py --lat 7.0195 --lon 79.9002 --backend local
+
+import argparse
+import asyncio
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from predictor import (DEFAULT_CONFIG, StationRegistry, WeatherPredictor, get_local_time,
+                       get_user_location)
+from alignment import record_time
+from power_tuner import default_tuning_path
+from station_fetch import parse_station_entry
+from storage import WS_EXPECTED_HEADERS, SheetsBackend, LocalBackend
+
+# Largest request line / header block accepted, in bytes
+MAX_REQUEST_BYTES = 8192
+
+# Seconds to wait for a client to send its request
+REQUEST_TIMEOUT = 10
+
+
+# Function to turn a receiver payload into a sheet record stamped with the local time
+def payload_to_record(payload, local_tz):
+    values = [value.strip() for value in payload.split(',')]
+    fields = WS_EXPECTED_HEADERS[2:]
+    if len(values) != len(fields):
+        raise ValueError(f"expected {len(fields)} values, got {len(values)}")
+    date_str, time_str = get_local_time(local_tz).split(" ")
+    return dict(zip(WS_EXPECTED_HEADERS, [date_str, time_str] + values))
+
+
+class IngestServer:
+    def __init__(self, registry, predictor=None, target_location=None, backend=None, min_stations=None):
+        self.registry = registry
+        self.predictor = predictor
+        self.target_location = target_location
+        self.backend = backend
+        # Predict once this many stations have a valid reading (default: all of them)
+        self.min_stations = min_stations or len(registry)
+
+        self.records = {}      # station -> last raw record received
+        self.latest_data = {}  # station -> last valid parsed reading
+        self.server = None
+
+    # Function to store a reading and recompute the predictions
+    def ingest(self, station, payload):
+        record = payload_to_record(payload, self.registry.local_tz)
+        self.records[station] = record
+        if self.backend is not None:
+            station_info = self.registry.stations[station]
+            self.backend.append_reading(station_info.get('sheet', station), record)
+
+        # Readings with "Error" tokens are stored but the last valid one is kept for IDW
+        self.latest_data[station] = parse_station_entry(record)
+        if self.predictor is not None:
+            timestamp = record_time(record)
+            self.predictor.aligner.add(station, timestamp, self.latest_data[station])
+            self.predictor.forecaster.update(station, timestamp, self.latest_data[station])
+
+        if self.predictor is not None and self.target_location and len(self.latest_data) >= self.min_stations:
+            data, weights = self.predictor.align(self.latest_data)
+            if len(data) < self.min_stations:
+                return record
+            predictions = self.predictor.predict(data, self.target_location, weights)
+            self.predictor.write_predictions(self.target_location, predictions, f"{record['Date']} {record['Time']}")
+        return record
+
+    # Function to handle one HTTP connection
+    async def handle(self, reader, writer):
+        status, body = 200, "OK"
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            if len(request) > MAX_REQUEST_BYTES:
+                raise ValueError("request too large")
+            method, target, _ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            if method != "GET":
+                status, body = 405, "Only GET is supported"
+            else:
+                url = urlsplit(target)
+                query = parse_qs(url.query)
+                station = query.get('station', [unquote(url.path).strip('/').split('/')[-1]])[0]
+                payload = query.get('data', [None])[0]
+                if station not in self.registry.stations:
+                    status, body = 404, f"Unknown station: {station}"
+                elif payload is None:
+                    status, body = 400, "Missing data parameter"
+                else:
+                    try:
+                        self.ingest(station, payload)
+                    except (ValueError, KeyError) as e:
+                        print(f"[{station}] Data format issue: {e}")
+                        status, body = 422, f"Invalid data: {e}"
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+            status, body = 400, "Bad request"
+
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  422: "Unprocessable Entity"}[status]
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host="0.0.0.0", port=8080):
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_BYTES)
+        print(f"📡 Listening for receiver data on http://{host}:{port}/<station>?data=...")
+        return self.server
+
+    async def serve_forever(self, host="0.0.0.0", port=8080):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Receive station readings over HTTP and predict as they arrive.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="station config file (JSON)")
+    parser.add_argument("--stations", help="comma separated subset of stations to use, e.g. WS1,WS2")
+    parser.add_argument("--output", help="prediction sheet name (default: preN for N stations)")
+    parser.add_argument("--lat", type=float, help="latitude of the target location")
+    parser.add_argument("--lon", type=float, help="longitude of the target location")
+    parser.add_argument("--min-stations", type=int, help="predict once this many stations have reported")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--backend", choices=["sheets", "local"], default="local",
+                        help="where readings and predictions are stored")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store (--backend local)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    subset = [name.strip() for name in args.stations.split(",")] if args.stations else None
+    registry = StationRegistry.from_config(args.config, subset=subset, output_sheet=args.output)
+    target_location = ({'latitude': args.lat, 'longitude': args.lon}
+                       if args.lat is not None and args.lon is not None else get_user_location())
+
+    backend = LocalBackend(args.data_dir) if args.backend == "local" else SheetsBackend(registry.credentials)
+    predictor = WeatherPredictor(registry, {}, backend.open_predictions(registry.output_sheet),
+                                 tuning_file=default_tuning_path(args.config))
+    server = IngestServer(registry, predictor, target_location, backend=backend, min_stations=args.min_stations)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nIngest server manually stopped.")
+    finally:
+        predictor.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
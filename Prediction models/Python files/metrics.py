@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Timing spans, counters and gauges for the prediction pipeline.
+#
+# Every stage of a cycle is wrapped in a span (auth, open, fetch, sheet_read,
+# parse, align, predict, forecast, queue, sheet_write), and the pipeline
+# counts retries, parse failures, rows and bytes fetched and rows written.
+# Everything is recorded in the module-level METRICS registry and exported:
+#
+#   - as Prometheus text on http://<host>:<port>/metrics (serve_metrics),
+#   - optionally as a JSON-lines trace, one line per finished span
+#     (METRICS.open_trace).
+#
+#     python predictor.py --metrics-port 9100 --trace trace.jsonl
+#     curl http://localhost:9100/metrics
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prefix of every exported metric
+PREFIX = "weather_"
+
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Help text of the exported metrics
+HELP = {
+    'stage_duration_seconds': "Time spent in each stage of the prediction pipeline",
+    'station_retries_total': "Failed station polls that were scheduled for a retry",
+    'parse_failures_total': "Station rows that could not be parsed",
+    'rows_fetched_total': "Rows downloaded from the station sheets",
+    'bytes_fetched_total': "Bytes of cell data downloaded from the station sheets",
+    'rows_written_total': "Prediction rows written to the prediction sheet",
+    'write_retries_total': "Failed prediction writes that were retried",
+    'predictions_total': "Prediction cycles completed",
+    'station_staleness_seconds': "Age of the latest reading of each station at the last cycle",
+    'pending_prediction_rows': "Prediction (or received station) rows waiting to be written to each sheet",
+}
+
+
+# Function to turn labels into a hashable, sorted key
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+# Function to format a label key the Prometheus way, e.g. {station="WS1"}
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda value: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}    # name -> {label key: value}
+        self.gauges = {}      # name -> {label key: value}
+        self.histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self.trace_file = None
+
+    # Function to add to a counter
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    # Function to set a gauge
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    # Function to record one observation in a histogram
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    # Function to time a block of code as a stage of the pipeline
+    @contextmanager
+    def span(self, stage, **labels):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.observe('stage_duration_seconds', duration, stage=stage, **labels)
+            if self.trace_file is not None:
+                self._trace(stage, labels, duration, error)
+
+    # Function to write finished spans to a JSON-lines file
+    def open_trace(self, path):
+        self.trace_file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def _trace(self, stage, labels, duration, error):
+        record = {'time': time.time(), 'stage': stage, 'duration_ms': round(duration * 1000, 3),
+                  'thread': threading.current_thread().name, **{k: str(v) for k, v in labels.items()}}
+        if error:
+            record['error'] = error
+        line = json.dumps(record)
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.write(line + "\n")
+
+    # Function to render every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, counts in sorted(series.items()):
+                    for bound, count in zip(self.buckets, counts):
+                        lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', '+Inf')])} {counts[-1]}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {counts[-2]}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+
+# Registry used by every module of the pipeline
+METRICS = Metrics()
+
+
+# Function to serve the metrics on /metrics from a background thread
+def serve_metrics(port, host="127.0.0.1", metrics=METRICS):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # keep the console for the prediction output
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Gridded nowcast over a bounding box.
+#
+# Instead of one target typed in at the prompt, every cell of a grid over the
+# bounding box is predicted each cycle. The rasters are written to
+# memory-mapped .npy files next to a small JSON header, so dashboards and tile
+# servers can map the latest frame without recomputing or parsing anything:
+#
+#     <out>/header.json             frame number, time, bounding box, shape,
+#                                   categories and the file of every parameter
+#     <out>/temperature.0.npy       float32 rasters, shape (rows, cols),
+#     <out>/temperature.1.npy       row 0 is the southern edge
+#     <out>/air_quality.0.npy       int8 category codes, see "categories"
+#     ...
+#
+# Frames alternate between the .0 and .1 files and header.json is replaced
+# atomically after a frame is complete, so a reader that opens the files named
+# in the header never sees a half-written frame (as long as it finishes
+# reading before the next-but-one frame starts).
+#
+#     python nowcast_grid.py --bbox 7.018,79.899,7.021,79.902 --resolution 10 --out grid
+
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from idw_engine import IDWWeightCache, CategoryEncoder, NUMERIC_PARAMS, CATEGORICAL_PARAMS
+from spatial_index import StationIndex, idw_neighbors_estimate, idw_neighbors_vote
+
+# Metres per degree of latitude
+METRES_PER_DEGREE = 111_320.0
+
+# Above this many (cells x stations) the dense weight matrix is not cached and
+# every cell uses only its k nearest stations instead
+MAX_DENSE_WEIGHTS = 20_000_000
+DEFAULT_GRID_K = 8
+
+
+# Function to turn a parameter name into a file name
+def field_name(param):
+    return re.sub(r'[^a-z0-9]+', '_', param.lower()).strip('_')
+
+
+class NowcastGrid:
+    def __init__(self, bbox, resolution_m, output_dir, k_nearest=None):
+        south, west, north, east = bbox
+        if not (south < north and west < east):
+            raise ValueError("Bounding box must be south,west,north,east with south < north and west < east")
+        self.bbox = (south, west, north, east)
+        self.output_dir = output_dir
+        self.k_nearest = k_nearest
+
+        # Cell centres, evenly spaced in metres at the centre latitude
+        lat_step = resolution_m / METRES_PER_DEGREE
+        lon_step = resolution_m / (METRES_PER_DEGREE * np.cos(np.radians((south + north) / 2)))
+        self.latitudes = np.arange(south + lat_step / 2, north, lat_step)
+        self.longitudes = np.arange(west + lon_step / 2, east, lon_step)
+        self.shape = (len(self.latitudes), len(self.longitudes))
+        lat_grid, lon_grid = np.meshgrid(self.latitudes, self.longitudes, indexing='ij')
+        self.targets = np.column_stack([lat_grid.ravel(), lon_grid.ravel()])
+
+        self.weight_cache = IDWWeightCache(max_entries=2)
+        self.encoders = {param: CategoryEncoder.for_param(param) for param in CATEGORICAL_PARAMS}
+        self.station_index = None
+        self.frame = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.targets)
+
+    # Function to predict every parameter for every cell; returns param -> (rows, cols) array.
+    # station_weights (name -> factor) scales the IDW weight of some stations,
+    # e.g. the stale readings down-weighted by WeatherPredictor.align, and
+    # tuning (param -> {'power', 'k_nearest'}, see power_tuner.py) overrides p
+    # and the number of neighbours per numerical parameter.
+    def compute(self, stations, latest_data, p, station_weights=None, tuning=None):
+        names = [name for name in stations if name in latest_data]
+        factors = [station_weights.get(name, 1.0) for name in names] if station_weights else None
+        rasters = {}
+
+        # Parameters tuned to the same power and k are predicted together
+        groups = {}
+        for param in NUMERIC_PARAMS:
+            setting = (tuning or {}).get(param, {})
+            key = (setting.get('power', p), setting.get('k_nearest') or self.k_nearest)
+            groups.setdefault(key, []).append(param)
+        # One weight matrix per power, shared by the estimates and the votes
+        self.weight_cache.max_entries = max(self.weight_cache.max_entries, len({power for power, _ in groups} | {p}))
+
+        for (power, k), params in groups.items():
+            if self._dense(k, names):
+                numeric = self.weight_cache.estimate(stations, latest_data, self.targets, power, params=params,
+                                                     station_weights=station_weights)
+            else:
+                values = np.array([[latest_data[name][param] for param in params] for name in names])
+                numeric = idw_neighbors_estimate(self._index(stations, names), self.targets, values, power,
+                                                 k=k or DEFAULT_GRID_K, decimals=None, factors=factors)
+            for i, param in enumerate(params):
+                rasters[param] = numeric[:, i].reshape(self.shape)
+
+        for param in CATEGORICAL_PARAMS:
+            if self._dense(self.k_nearest, names):
+                codes = self.weight_cache.vote_codes(stations, latest_data, self.targets, p, param, self.encoders[param],
+                                                     station_weights)
+            else:
+                # Many stations: each cell only uses its k nearest stations
+                codes = idw_neighbors_vote(self._index(stations, names), self.targets,
+                                           self.encoders[param].encode_many(latest_data[name][param] for name in names),
+                                           p, k=self.k_nearest or DEFAULT_GRID_K, factors=factors)
+            rasters[param] = codes.reshape(self.shape)
+        return {param: rasters[param] for param in NUMERIC_PARAMS + CATEGORICAL_PARAMS}
+
+    # Function to decide whether every cell can use every station (dense weight matrix)
+    def _dense(self, k, names):
+        return k is None and len(self.targets) * len(names) <= MAX_DENSE_WEIGHTS
+
+    # Function to get the spatial index of the stations that have a reading
+    def _index(self, stations, names):
+        if self.station_index is None or self.station_index.names != names:
+            self.station_index = StationIndex.from_stations({name: stations[name] for name in names})
+        return self.station_index
+
+    # Function to write a frame to the memory-mapped rasters and publish it in header.json
+    def write_frame(self, rasters, timestamp=None):
+        slot = self.frame % 2
+        files = {}
+        for param, raster in rasters.items():
+            dtype = np.int8 if param in CATEGORICAL_PARAMS else np.float32
+            file_name = f"{field_name(param)}.{slot}.npy"
+            path = os.path.join(self.output_dir, file_name)
+            if os.path.exists(path):
+                target = np.load(path, mmap_mode='r+')
+                if target.shape != self.shape or target.dtype != dtype:
+                    target = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=self.shape)
+            else:
+                target = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=self.shape)
+            target[...] = raster
+            target.flush()
+            del target
+            files[param] = file_name
+
+        header = {
+            'frame': self.frame,
+            'timestamp': timestamp if timestamp is not None else time.time(),
+            'bbox': {'south': self.bbox[0], 'west': self.bbox[1], 'north': self.bbox[2], 'east': self.bbox[3]},
+            'shape': list(self.shape),
+            'latitudes': [float(self.latitudes[0]), float(self.latitudes[-1])] if len(self.latitudes) else [],
+            'longitudes': [float(self.longitudes[0]), float(self.longitudes[-1])] if len(self.longitudes) else [],
+            'files': files,
+            'categories': {param: list(self.encoders[param].categories) for param in CATEGORICAL_PARAMS},
+        }
+        temp_path = os.path.join(self.output_dir, "header.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(header, f, indent=2)
+        os.replace(temp_path, os.path.join(self.output_dir, "header.json"))
+        self.frame += 1
+        return header
+
+
+# Function for readers: map the latest frame of a grid directory without copying it
+def read_latest_frame(output_dir):
+    with open(os.path.join(output_dir, "header.json")) as f:
+        header = json.load(f)
+    rasters = {param: np.load(os.path.join(output_dir, file_name), mmap_mode='r')
+               for param, file_name in header['files'].items()}
+    return header, rasters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Predict every cell of a grid over a bounding box.")
+    parser.add_argument("--config", help="station config file (JSON)")
+    parser.add_argument("--stations", help="comma separated subset of stations to use")
+    parser.add_argument("--bbox", required=True, help="south,west,north,east in degrees")
+    parser.add_argument("--resolution", type=float, default=10.0, help="cell size in metres")
+    parser.add_argument("--k-nearest", type=int, help="use only the k nearest stations for each cell")
+    parser.add_argument("--out", default="grid", help="output directory for the rasters")
+    parser.add_argument("--tuning", help="tuned IDW powers from power_tuner.py (default: idw_power.json next to the config)")
+    parser.add_argument("--backend", choices=["sheets", "local"], default="sheets")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store (--backend local)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from power_tuner import default_tuning_path
+    from predictor import DEFAULT_CONFIG, StationRegistry, WeatherPredictor, get_local_time
+    from storage import SheetsBackend, LocalBackend
+
+    args = parse_args(argv)
+    subset = [name.strip() for name in args.stations.split(",")] if args.stations else None
+    config = args.config or DEFAULT_CONFIG
+    registry = StationRegistry.from_config(config, subset=subset)
+    bbox = [float(value) for value in args.bbox.split(",")]
+    grid = NowcastGrid(bbox, args.resolution, args.out, k_nearest=args.k_nearest)
+    print(f"Grid of {grid.shape[0]} x {grid.shape[1]} cells over {bbox}")
+
+    backend = LocalBackend(args.data_dir) if args.backend == "local" else SheetsBackend(registry.credentials)
+    station_sheets = {name: backend.open_station(name, info) for name, info in registry.stations.items()}
+    # Predictions go to the rasters only, so there is no prediction sheet
+    predictor = WeatherPredictor(registry, station_sheets, None, tuning_file=args.tuning or default_tuning_path(config))
+
+    latest_data = {}
+    try:
+        while True:
+            due = predictor.scheduler.due_stations()
+            if due:
+                current_time = get_local_time(registry.local_tz)
+                print(f"Fetching data at {current_time}...")
+                if predictor.poll_stations(due, latest_data) and predictor.ready(latest_data):
+                    data, weights = predictor.align(latest_data)
+                    if len(data) < predictor.min_stations:
+                        print("Not enough fresh readings to predict.")
+                    else:
+                        start = time.perf_counter()
+                        predictor.reload_tuning()
+                        rasters = grid.compute(registry.stations, data, registry.power, weights, predictor.tuning)
+                        header = grid.write_frame(rasters)
+                        print(f"✅ Frame {header['frame']} written at {current_time} "
+                              f"({len(grid)} cells in {time.perf_counter() - start:.2f} s)")
+            predictor.scheduler.wait()
+    except KeyboardInterrupt:
+        print("\nGrid nowcast manually stopped.")
+    finally:
+        predictor.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# IDW power tuning by leave-one-station-out cross-validation.
+#
+# The scripts used p = 2 for every parameter, but temperature, humidity and
+# pressure do not vary over space in the same way. The tuner replays the
+# station history in the local store and, at every time step, predicts each
+# station from the others for every candidate power (and optional k-nearest
+# setting). The power with the lowest RMSE is picked per parameter, but only
+# when it beats the power of the config (stations.json) by more than
+# MIN_IMPROVEMENT; on ties or noise-level differences the config power is
+# kept. The result is written to a small JSON file that the predictor reloads
+# when it changes:
+#
+#     {"updated": "...", "parameters": {"Temperature": {"power": 1.5, "k_nearest": null, "rmse": 0.41, "points": 1200}, ...}}
+#
+# The predictions for all powers, stations and time steps of a block are two
+# einsum calls, so the whole history is evaluated without per-station loops.
+#
+#     python power_tuner.py --data-dir data
+#     python power_tuner.py --data-dir data --k-values 2,3 --every-hours 6
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from idw_engine import NUMERIC_PARAMS, haversine_matrix, idw_weights
+from backtest import align_as_of, DEFAULT_TOLERANCE
+from scheduler import DEFAULT_CADENCE
+
+# Candidate powers
+POWER_GRID = np.round(np.arange(0.5, 5.01, 0.25), 2)
+
+# Time steps evaluated per block, to bound memory
+TIME_BLOCK = 2048
+
+# RMSE improvement another setting needs over the config power to be picked:
+# relative, and absolute (the precision the RMSE is saved with), so that
+# floating-point noise on a tie never decides
+MIN_IMPROVEMENT = 0.02
+MIN_IMPROVEMENT_ABS = 1e-4
+
+# Tuning file name, next to the station config
+TUNING_FILE = "idw_power.json"
+
+
+# Function to find the tuning file that belongs to a config file
+def default_tuning_path(config_path):
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), TUNING_FILE)
+
+
+# Function to read the tuned settings: param -> {'power', 'k_nearest'}.
+# A missing or unreadable file means no tuning yet.
+def load_tuning(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get('parameters', {})
+    except (OSError, ValueError):
+        return {}
+
+
+# Function to write the tuned settings atomically, so a predictor reloading
+# the file never reads half of it
+def save_tuning(path, results):
+    data = {'updated': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'parameters': results}
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+# Function to get the leave-one-out squared errors of one parameter.
+# distances is the (stations, stations) distance matrix, values and valid
+# have shape (times, stations). Every station is predicted from the other
+# stations with a valid reading, or only the k nearest of them, like the live
+# predictor. Returns (sum of squared errors, points), both of shape
+# (len(k_values), len(powers)).
+def loo_errors(distances, values, valid, powers=POWER_GRID, k_values=(None,), time_block=TIME_BLOCK):
+    station_count = distances.shape[0]
+    # Other stations of every station, nearest first
+    masked = distances + np.diag(np.full(station_count, np.inf))
+    order = np.argsort(masked, axis=1, kind='stable')[:, :station_count - 1]
+    sorted_distances = np.take_along_axis(distances, order, axis=1)
+    weights = np.stack([idw_weights(sorted_distances, p) for p in powers])  # (powers, stations, others)
+
+    sse = np.zeros((len(k_values), len(powers)))
+    points = np.zeros((len(k_values), len(powers)), dtype=np.int64)
+    for start in range(0, len(values), time_block):
+        truth = values[start:start + time_block]
+        truth_ok = valid[start:start + time_block]
+        others = truth[:, order]                      # (times, stations, others)
+        present = truth_ok[:, order]
+        rank = np.cumsum(present, axis=2)             # position among the present neighbours
+
+        for j, k in enumerate(k_values):
+            include = (present & (rank <= k) if k else present).astype(float)
+            numerator = np.einsum('gab,tab->gta', weights, include * others)
+            denominator = np.einsum('gab,tab->gta', weights, include)
+            ok = truth_ok[None] & (denominator > 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                errors = np.where(ok, numerator / denominator - truth[None], 0.0)
+            sse[j] += (errors ** 2).sum(axis=(1, 2))
+            points[j] += ok.sum(axis=(1, 2))
+    return sse, points
+
+
+# Function to pick the best power (and k) of every parameter.
+# values and valid have shape (times, stations, params). The config power
+# (with every station, or the first k setting) is kept unless another setting
+# has an RMSE lower by more than min_improvement (and MIN_IMPROVEMENT_ABS).
+def tune(distances, values, valid, powers=POWER_GRID, k_values=(None,), params=NUMERIC_PARAMS,
+         default_power=2, min_improvement=MIN_IMPROVEMENT):
+    powers = np.union1d(powers, [default_power])
+    default = (k_values.index(None) if None in k_values else 0, int(np.flatnonzero(powers == default_power)[0]))
+    results = {}
+    for i, param in enumerate(params):
+        sse, points = loo_errors(distances, values[:, :, i], valid[:, :, i], powers, k_values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rmse = np.where(points > 0, np.sqrt(sse / np.maximum(points, 1)), np.inf)
+        if not np.isfinite(rmse).any():
+            continue
+        j, g = np.unravel_index(np.argmin(rmse), rmse.shape)
+        if not rmse[default] - rmse[j, g] > max(rmse[default] * min_improvement, MIN_IMPROVEMENT_ABS):
+            j, g = default
+        results[param] = {
+            'power': float(powers[g]),
+            'k_nearest': k_values[j],
+            'rmse': round(float(rmse[j, g]), 4),
+            'points': int(points[j, g]),
+        }
+    return results
+
+
+class PowerTuner:
+    # Re-tunes the powers from the local store history and writes the tuning file
+    def __init__(self, registry, backend, path, powers=POWER_GRID, k_values=(None,),
+                 step=DEFAULT_CADENCE, tolerance=DEFAULT_TOLERANCE):
+        self.registry = registry
+        self.backend = backend
+        self.path = path
+        self.powers = powers
+        self.k_values = tuple(k_values)
+        self.step = step
+        self.tolerance = tolerance
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Function to put every station on a common time grid (one step per cadence)
+    def load_history(self):
+        names = self.registry.names()
+        series = [self.backend.scan(self.registry.stations[name].get('sheet', name), fields=NUMERIC_PARAMS)
+                  for name in names]
+        stamps = [s['timestamp'] for s in series if len(s['timestamp'])]
+        if not stamps:
+            return names, np.zeros((0, len(names), len(NUMERIC_PARAMS))), np.zeros((0, len(names), len(NUMERIC_PARAMS)), dtype=bool)
+        start = min(s[0] for s in stamps)
+        end = max(s[-1] for s in stamps)
+        times = np.arange(start, end + self.step, self.step)
+        values, valid = align_as_of(times, series, self.tolerance)
+        return names, values, valid
+
+    # Function to run one tuning pass and save the result
+    def run(self):
+        names, values, valid = self.load_history()
+        latitudes = [self.registry.stations[name]['latitude'] for name in names]
+        longitudes = [self.registry.stations[name]['longitude'] for name in names]
+        distances = haversine_matrix(latitudes, longitudes, latitudes, longitudes)
+        results = tune(distances, values, valid, self.powers, self.k_values, default_power=self.registry.power)
+        if results:
+            save_tuning(self.path, results)
+        return results
+
+    # Function to re-tune every interval seconds on a background thread
+    def start(self, interval):
+        def loop():
+            while not self.stop_event.is_set():
+                try:
+                    results = self.run()
+                    print("IDW powers re-tuned: " +
+                          ", ".join(f"{param} p={r['power']}" for param, r in results.items()))
+                except Exception as e:
+                    print(f"Error re-tuning IDW powers: {e}")
+                self.stop_event.wait(interval)
+
+        self.thread = threading.Thread(target=loop, name="power-tuner", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the IDW power of every parameter by leave-one-station-out cross-validation.")
+    parser.add_argument("--config", help="station config file (JSON)")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store")
+    parser.add_argument("--out", help=f"tuning file (default: {TUNING_FILE} next to the config)")
+    parser.add_argument("--powers", help="comma separated candidate powers (default: 0.5 to 5 in steps of 0.25)")
+    parser.add_argument("--k-values", help="comma separated k-nearest settings to try as well, e.g. 2,3")
+    parser.add_argument("--step", type=float, default=DEFAULT_CADENCE, help="seconds between evaluated time steps")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="seconds a station reading stays usable")
+    parser.add_argument("--every-hours", type=float, help="keep running and re-tune at this interval")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from predictor import DEFAULT_CONFIG, StationRegistry
+    from storage import LocalBackend
+
+    args = parse_args(argv)
+    config = args.config or DEFAULT_CONFIG
+    registry = StationRegistry.from_config(config)
+    powers = np.array([float(p) for p in args.powers.split(",")]) if args.powers else POWER_GRID
+    k_values = [None] + ([int(k) for k in args.k_values.split(",")] if args.k_values else [])
+    tuner = PowerTuner(registry, LocalBackend(args.data_dir), args.out or default_tuning_path(config),
+                       powers, k_values, args.step, args.tolerance)
+
+    while True:
+        started = time.perf_counter()
+        results = tuner.run()
+        if not results:
+            print(f"No station history in {args.data_dir} to tune on")
+        for param, result in results.items():
+            k = f", k={result['k_nearest']}" if result['k_nearest'] else ""
+            print(f"   - {param}: p={result['power']}{k} (RMSE {result['rmse']} over {result['points']} points)")
+        print(f"Tuned in {time.perf_counter() - started:.1f} s, saved to {tuner.path}")
+        if not args.every_hours:
+            break
+        time.sleep(args.every_hours * 3600)
+
+
+if __name__ == "__main__":
+    main()
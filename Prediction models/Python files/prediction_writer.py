@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Write-behind sink for the prediction rows.
+#
+# Calling append_row() once per prediction is a synchronous remote write on
+# the critical path of every cycle. BufferedSheetWriter queues the rows and a
+# background thread writes them with one append_rows() call when enough rows
+# are queued or the oldest row has waited long enough. Failed writes are
+# retried with exponential backoff, and rows that still cannot be written when
+# the writer is closed are saved to a local CSV file instead of being lost.
+# ingest_server.py uses one per station sheet for the readings it receives.
+
+import csv
+import random
+import threading
+import time
+
+from metrics import METRICS
+
+# Flush when this many rows are queued...
+FLUSH_ROWS = 20
+# ...or when the oldest queued row has waited this many seconds
+FLUSH_SECONDS = 30
+
+# Retry settings for a failed write
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Rows that could not be written on shutdown are appended here
+UNSENT_ROWS_FILE = "unsent_predictions.csv"
+
+
+class BufferedSheetWriter:
+    def __init__(self, sheet, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS,
+                 max_retries=MAX_RETRIES, unsent_rows_file=UNSENT_ROWS_FILE, name="prediction-writer"):
+        self.sheet = sheet
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self.unsent_rows_file = unsent_rows_file
+
+        self.rows = []
+        self.oldest = None          # time the oldest queued row was added
+        self.in_flight = 0          # rows taken by the writer thread but not yet written
+        self.retry_at = 0           # after a failed batch, wait until this time before retrying
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    # Function to queue a row; returns immediately
+    def append_row(self, row):
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Prediction writer is closed")
+            self.rows.append(row)
+            METRICS.set_gauge('pending_prediction_rows', len(self.rows) + self.in_flight, sheet=self.sheet.title)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if len(self.rows) >= self.flush_rows:
+                self.condition.notify_all()
+
+    # Function to check (with the lock held) whether the queued rows are due
+    def _due(self):
+        if not self.rows:
+            return False
+        if self.closed:
+            return True
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        return len(self.rows) >= self.flush_rows or now - self.oldest >= self.flush_seconds
+
+    # Background thread: wait for a batch to be due and write it
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._due():
+                    if self.closed and not self.rows:
+                        return
+                    timeout = None
+                    if self.rows:
+                        now = time.monotonic()
+                        timeout = max(self.flush_seconds - (now - self.oldest), self.retry_at - now, 0)
+                    self.condition.wait(timeout)
+                batch, self.rows, self.oldest = self.rows, [], None
+                METRICS.set_gauge('pending_prediction_rows', len(batch), sheet=self.sheet.title)
+                self.in_flight = len(batch)
+
+            written = self._write(batch)
+
+            with self.condition:
+                self.in_flight = 0
+                if not written:
+                    if self.closed:
+                        self._save_unsent(batch + self.rows)
+                        self.rows, self.oldest = [], None
+                    else:
+                        # Put the batch back in front of the newer rows and try again later
+                        self.rows = batch + self.rows
+                        self.oldest = time.monotonic()
+                        self.retry_at = self.oldest + self.flush_seconds
+                self.condition.notify_all()
+
+    # Function to write one batch, retrying with exponential backoff and jitter
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with METRICS.span('sheet_write'):
+                    self.sheet.append_rows(batch)
+                METRICS.inc('rows_written_total', len(batch))
+                return True
+            except Exception as e:
+                METRICS.inc('write_retries_total')
+                if attempt == self.max_retries:
+                    print(f"Failed to write {len(batch)} rows to {self.sheet.title}: {e}")
+                    return False
+                delay = min(BASE_BACKOFF * 2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1.5)
+                print(f"Writing to {self.sheet.title} failed ({e}). Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+
+    # Function to keep rows that could not be written in a local CSV file
+    def _save_unsent(self, rows):
+        with open(self.unsent_rows_file, "a", newline="") as f:
+            csv.writer(f).writerows(rows)
+        print(f"Saved {len(rows)} unsent rows of {self.sheet.title} to {self.unsent_rows_file}")
+
+    # Function to write the remaining rows and stop the background thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
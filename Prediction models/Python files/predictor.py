@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Weather predictor for any number of IoT weather stations.
+#
+# The stations, their sheets and the IDW settings are loaded from a JSON
+# config file (stations.json) instead of being hard-coded, and a subset of the
+# stations can be picked at runtime:
+#
+#     python predictor.py                          # every station in the config
+#     python predictor.py --stations WS1,WS2       # writes to pre2
+#     python predictor.py --stations WS1,WS3 --output pre_ws1_ws3
+#     python predictor.py --k-nearest 4 --radius-km 2   # only nearby stations
+#     python predictor.py --backend local --data-dir data   # offline, local store
+
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+import pytz
+
+from alignment import AsOfAligner, record_time
+from metrics import METRICS, serve_metrics
+from forecaster import HoltForecaster, FORECAST_HORIZONS, interpolate_forecasts
+from sheet_tail import SheetTailReader
+from station_fetch import StationFetcher
+from idw_engine import IDWWeightCache, CategoryEncoder, NUMERIC_PARAMS, CATEGORICAL_PARAMS
+from spatial_index import StationIndex
+from prediction_writer import BufferedSheetWriter
+from scheduler import AdaptiveScheduler, DEFAULT_CADENCE
+from power_tuner import PowerTuner, default_tuning_path, load_tuning
+from storage import WS_EXPECTED_HEADERS, PD_EXPECTED_HEADERS, SheetsBackend, LocalBackend, parse_timestamp
+
+# Default config file, next to this script
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+
+
+
+class StationRegistry:
+    # Weather stations and prediction settings loaded from the config file
+    def __init__(self, stations, power=2, timezone_name='Asia/Colombo', credentials=None, output_sheet=None,
+                 k_nearest=None, radius_km=None, max_age=None, stale_policy='drop'):
+        if not stations:
+            raise ValueError("At least one weather station is required")
+        self.stations = stations          # name -> {'latitude', 'longitude', 'sheet'}
+        self.power = power
+        self.local_tz = pytz.timezone(timezone_name)
+        self.credentials = credentials
+        self.output_sheet = output_sheet or f"pre{len(stations)}"
+        # Optional neighbour selection for IDW (None = use every station)
+        self.k_nearest = k_nearest
+        self.radius_km = radius_km
+        # Readings older than max_age seconds are dropped or down-weighted (None = never stale)
+        self.max_age = max_age
+        self.stale_policy = stale_policy
+
+    # Function to load the registry from a config file, optionally keeping only some stations
+    @classmethod
+    def from_config(cls, path=DEFAULT_CONFIG, subset=None, output_sheet=None, k_nearest=None, radius_km=None,
+                    max_age=None, stale_policy=None):
+        with open(path) as f:
+            config = json.load(f)
+
+        stations = config['stations']
+        if subset:
+            unknown = [name for name in subset if name not in stations]
+            if unknown:
+                raise ValueError(f"Unknown stations in subset: {', '.join(unknown)}")
+            stations = {name: stations[name] for name in subset}
+
+        stations = {
+            name: {
+                'latitude': float(info['latitude']),
+                'longitude': float(info['longitude']),
+                'sheet': info.get('sheet', name),
+                # Seconds between two polls of this station
+                'cadence': float(info.get('cadence', config.get('cadence', DEFAULT_CADENCE)))
+            }
+            for name, info in stations.items()
+        }
+        return cls(
+            stations,
+            power=config.get('power', 2),
+            timezone_name=config.get('timezone', 'Asia/Colombo'),
+            credentials=config.get('credentials'),
+            output_sheet=output_sheet,
+            k_nearest=k_nearest if k_nearest is not None else config.get('k_nearest'),
+            radius_km=radius_km if radius_km is not None else config.get('radius_km'),
+            max_age=max_age if max_age is not None else config.get('max_age'),
+            stale_policy=stale_policy or config.get('stale_policy', 'drop')
+        )
+
+    def names(self):
+        return list(self.stations)
+
+    def __len__(self):
+        return len(self.stations)
+
+
+def get_user_location():
+    while True:
+        try:
+            lat = float(input("Enter the latitude of the target location: "))
+            lon = float(input("Enter the longitude of the target location: "))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return {'latitude': lat, 'longitude': lon}
+            else:
+                print("Invalid coordinates. Please enter valid latitude and longitude.")
+        except ValueError:
+            print("Invalid input. Please enter numerical values.")
+
+def get_local_time(local_tz):
+    utc_time = datetime.now(timezone.utc)
+    local_time = utc_time.astimezone(local_tz)
+    return local_time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class WeatherPredictor:
+    def __init__(self, registry, station_sheets, prediction_sheet, allow_partial_stations=False, min_stations=1,
+                 tuning_file=None, interpolate=False, align_lag=0, forecast_horizons=FORECAST_HORIZONS):
+        self.registry = registry
+        self.station_sheets = station_sheets
+        self.prediction_sheet = prediction_sheet
+        self.allow_partial_stations = allow_partial_stations
+        self.min_stations = min_stations
+
+        # Remembers the last row read from each sheet so only new rows are downloaded
+        self.tail_reader = SheetTailReader()
+        # Normalized IDW weights for the target, rebuilt only when the stations or the target change
+        self.weight_cache = IDWWeightCache()
+        # Integer codes of the categorical values, kept across cycles
+        self.encoders = {param: CategoryEncoder.for_param(param) for param in CATEGORICAL_PARAMS}
+        # Station sheets are fetched on a shared thread pool
+        self.station_fetcher = StationFetcher(self.fetch_latest_data)
+        # Spatial index over the stations that answered, rebuilt when that set changes
+        self.station_index = None
+        # Prediction rows are written in batches by a background thread
+        self.prediction_writer = BufferedSheetWriter(prediction_sheet) if prediction_sheet is not None else None
+        # Decides when each station is polled again
+        self.scheduler = AdaptiveScheduler({name: registry.stations[name].get('cadence') for name in station_sheets})
+        # Timestamped readings of every station, joined to a common cycle time before IDW
+        self.aligner = AsOfAligner(registry.max_age, registry.stale_policy, interpolate=interpolate)
+        self.align_lag = align_lag
+        # Level and trend of every station, for forecasts ahead in time
+        self.forecaster = HoltForecaster(registry.names())
+        self.forecast_horizons = forecast_horizons
+        # Tuned IDW power (and k) per parameter, reloaded when the tuning file changes
+        self.tuning_file = tuning_file
+        self.tuning = {}
+        self.tuning_mtime = None
+        self.reload_tuning()
+
+    # Function to reload the tuned powers written by power_tuner.py
+    def reload_tuning(self):
+        if self.tuning_file is None:
+            return
+        try:
+            mtime = os.path.getmtime(self.tuning_file)
+        except OSError:
+            return
+        if mtime != self.tuning_mtime:
+            self.tuning_mtime = mtime
+            self.tuning = load_tuning(self.tuning_file)
+            if self.tuning:
+                print("Using tuned IDW powers: " +
+                      ", ".join(f"{param} p={setting['power']}" for param, setting in self.tuning.items()))
+
+    def fetch_latest_data(self, sheet):
+        expected_headers = PD_EXPECTED_HEADERS if sheet is self.prediction_sheet else WS_EXPECTED_HEADERS
+        try:
+            with METRICS.span('fetch', sheet=sheet.title):
+                return self.tail_reader.read_latest(sheet, expected_headers)
+        except Exception as e:
+            print(f"Error fetching data from {sheet.title}: {e}")
+            return None
+
+    # Function to poll the given stations concurrently and merge their readings
+    # into latest_data. Returns True when at least one station had new rows.
+    def poll_stations(self, names, latest_data):
+        sheets = {name: self.station_sheets[name] for name in names}
+        cursors = {name: self.tail_reader.cursors.get(sheet.title) for name, sheet in sheets.items()}
+        fresh = {}
+        self.station_fetcher.fetch_missing(sheets, fresh)
+
+        changed = False
+        for name, sheet in sheets.items():
+            if name in fresh:
+                # The tail read only returns rows when the sheet grew
+                station_changed = self.tail_reader.cursors.get(sheet.title) != cursors[name]
+                self.scheduler.record_success(name, station_changed)
+                if station_changed or name not in latest_data:
+                    latest_data[name] = fresh[name]
+                    timestamp = record_time(self.tail_reader.latest.get(sheet.title))
+                    self.aligner.add(name, timestamp, fresh[name])
+                    self.forecaster.update(name, timestamp if timestamp is not None else self.local_timestamp(),
+                                           fresh[name])
+                    changed = True
+            else:
+                # Keep the last good reading; align() drops or down-weights it once it is older than max_age
+                delay = self.scheduler.record_failure(name)
+                METRICS.inc('station_retries_total', station=name)
+                print(f"[{name}] Retrying in {delay:.0f} seconds...")
+        return changed
+
+    # Function to check whether enough stations have a reading to predict
+    def ready(self, latest_data):
+        missing = [name for name in self.station_sheets if name not in latest_data]
+        if not missing:
+            return True
+        if self.allow_partial_stations and len(latest_data) >= self.min_stations:
+            print(f"Missing {', '.join(missing)}. Predicting from {len(latest_data)} stations.")
+            return True
+        print(f"Waiting for {', '.join(missing)}...")
+        return False
+
+    # Function to get the current local time as a timestamp, comparable with the sheet Date/Time
+    def local_timestamp(self):
+        return parse_timestamp(*get_local_time(self.registry.local_tz).split(" "))
+
+    # Function to get the time every station is aligned to in this cycle
+    def cycle_time(self):
+        return self.local_timestamp() - self.align_lag
+
+    # Function to join the latest readings to the cycle time.
+    # Returns (data, station weights); stale readings are dropped or get a
+    # weight below 1, stations without a readable timestamp are used as they are.
+    def align(self, latest_data, cycle_time=None):
+        cycle_time = self.cycle_time() if cycle_time is None else cycle_time
+        timed = [name for name in latest_data if name in self.aligner.buffers]
+        data, weights, _ = self.aligner.align(cycle_time, timed)
+        for name in timed:
+            METRICS.set_gauge('station_staleness_seconds', self.aligner.age(name, cycle_time), station=name)
+        for name in latest_data:
+            if name not in self.aligner.buffers:
+                data[name] = latest_data[name]
+
+        stale = [name for name in timed if name not in data or weights[name] < 1]
+        if stale:
+            action = "Dropping" if self.registry.stale_policy == 'drop' else "Down-weighting"
+            print(f"{action} stale readings from {', '.join(stale)}")
+        return data, weights
+
+    # Function to keep only the k nearest stations / the stations within the radius
+    def select_neighbors(self, latest_data, target_location, k=None):
+        k = k or self.registry.k_nearest
+        if not k and self.registry.radius_km is None:
+            return latest_data
+        names = [name for name in self.registry.stations if name in latest_data]
+        if self.station_index is None or self.station_index.names != names:
+            self.station_index = StationIndex.from_stations({name: self.registry.stations[name] for name in names})
+        selected = self.station_index.select(
+            target_location['latitude'], target_location['longitude'],
+            k=k, radius_km=self.registry.radius_km
+        )
+        return {name: latest_data[name] for name in selected}
+
+    # Function to predict every parameter at the target from the latest readings
+    def predict(self, latest_data, target_location, station_weights=None):
+        self.reload_tuning()
+        stations = self.registry.stations
+        target = [(target_location['latitude'], target_location['longitude'])]
+        predictions = {}
+
+        # Parameters tuned to the same power and k are predicted together.
+        # Only the stations that answered are weighted, so IDW renormalizes over them.
+        groups = {}
+        for param in NUMERIC_PARAMS:
+            setting = self.tuning.get(param, {})
+            key = (setting.get('power', self.registry.power), setting.get('k_nearest'))
+            groups.setdefault(key, []).append(param)
+        for (p, k), params in groups.items():
+            neighbors = self.select_neighbors(latest_data, target_location, k)
+            numeric = self.weight_cache.predict(stations, neighbors, target, p, params=params,
+                                                station_weights=station_weights)
+            predictions.update({param: float(numeric[param][0]) for param in params})
+
+        neighbors = self.select_neighbors(latest_data, target_location)
+        for param in CATEGORICAL_PARAMS:
+            predictions[param] = self.weight_cache.vote(stations, neighbors, target, self.registry.power,
+                                                        param, self.encoders[param], station_weights)[0]
+        return {param: predictions[param] for param in NUMERIC_PARAMS + CATEGORICAL_PARAMS}
+
+    # Function to forecast the numerical parameters at the target for every horizon
+    # (minutes ahead); returns horizon -> {param: value}
+    def forecast(self, latest_data, target_location, horizons=None, station_weights=None):
+        horizons = self.forecast_horizons if horizons is None else horizons
+        stations = self.registry.stations
+        target = [(target_location['latitude'], target_location['longitude'])]
+        neighbors = self.select_neighbors(latest_data, target_location)
+        rows = [self.forecaster.index[name] for name in stations if name in neighbors]
+        now = self.local_timestamp()
+        station_forecasts = {minutes: self.forecaster.forecast(now + minutes * 60)[rows] for minutes in horizons}
+
+        forecasts = {minutes: {} for minutes in horizons}
+        for j, param in enumerate(self.forecaster.params):
+            p = self.tuning.get(param, {}).get('power', self.registry.power)
+            weights = self.weight_cache.raw_weights(stations, neighbors, target, p, station_weights)
+            for minutes in horizons:
+                value = interpolate_forecasts(weights, station_forecasts[minutes][:, j])[0]
+                forecasts[minutes][param] = round(float(value), 2)
+        return forecasts
+
+    # Function to queue a prediction row for the prediction sheet
+    def write_predictions(self, target_location, predictions, current_time):
+        date_str, time_str = get_local_time(self.registry.local_tz).split(" ")
+        new_row = [
+            date_str, time_str,
+            target_location['latitude'], target_location['longitude'],
+            predictions['Temperature'], predictions['Humidity'], predictions['Air Pressure'],
+            predictions['Air Quality'], predictions['Rain Status']
+        ]
+        self.prediction_writer.append_row(new_row)
+
+        print(f"\n✅ Predictions updated at {current_time} for location ({target_location['latitude']}, {target_location['longitude']}):")
+        for key, value in predictions.items():
+            print(f"   - {key}: {value}")
+
+    def update_predictions(self, target_location=None):
+        target_location = target_location or get_user_location()
+
+        latest_data = {}
+        while True:
+            due = self.scheduler.due_stations()
+            if due:
+                current_time = get_local_time(self.registry.local_tz)
+                print(f"Fetching data at {current_time}...")
+                with METRICS.span('cycle'):
+                    self.run_cycle(due, latest_data, target_location, current_time)
+            self.scheduler.wait()
+
+    # Function to run one cycle: poll the due stations and predict when some station has new data
+    def run_cycle(self, due, latest_data, target_location, current_time):
+        with METRICS.span('poll'):
+            changed = self.poll_stations(due, latest_data)
+        if not (changed and self.ready(latest_data)):
+            return
+        with METRICS.span('align'):
+            data, weights = self.align(latest_data)
+        if len(data) < self.min_stations:
+            print("Not enough fresh readings to predict.")
+            return
+
+        with METRICS.span('predict'):
+            predictions = self.predict(data, target_location, weights)
+        with METRICS.span('queue'):
+            self.write_predictions(target_location, predictions, current_time)
+        METRICS.inc('predictions_total')
+        if self.forecast_horizons:
+            with METRICS.span('forecast'):
+                forecasts = self.forecast(data, target_location, station_weights=weights)
+            for minutes, forecast in forecasts.items():
+                print(f"   +{minutes} min: " + ", ".join(f"{key}: {value}" for key, value in forecast.items()))
+
+    # Function to stop the workers; queued prediction rows are written before returning
+    def close(self):
+        self.station_fetcher.close()
+        if self.prediction_writer is not None:
+            self.prediction_writer.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Predict the weather at a location from the IoT weather stations.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="station config file (JSON)")
+    parser.add_argument("--stations", help="comma separated subset of stations to use, e.g. WS1,WS2")
+    parser.add_argument("--output", help="prediction sheet name (default: preN for N stations)")
+    parser.add_argument("--allow-partial", action="store_true",
+                        help="predict from the stations that answered instead of waiting for all of them")
+    parser.add_argument("--min-stations", type=int, default=1,
+                        help="minimum number of stations needed for a partial prediction")
+    parser.add_argument("--k-nearest", type=int, help="use only the k nearest stations for IDW")
+    parser.add_argument("--radius-km", type=float, help="use only the stations within this distance for IDW")
+    parser.add_argument("--backend", choices=["sheets", "local"], default="sheets",
+                        help="read and write Google Sheets or the local columnar store")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store (--backend local)")
+    parser.add_argument("--max-age", type=float, help="seconds after which a station reading is stale")
+    parser.add_argument("--stale", choices=["drop", "downweight"], help="what to do with stale readings (default: drop)")
+    parser.add_argument("--interpolate", action="store_true",
+                        help="interpolate the readings in time to the cycle time (lagging by --align-lag)")
+    parser.add_argument("--align-lag", type=float, help="seconds the cycle time lags behind now "
+                                                        "(default: the longest cadence with --interpolate, else 0)")
+    parser.add_argument("--forecast", default=",".join(map(str, FORECAST_HORIZONS)),
+                        help="comma separated forecast horizons in minutes, or 'none'")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--trace", help="append a JSON line per timed stage to this file")
+    parser.add_argument("--tuning", help="tuned IDW powers from power_tuner.py (default: idw_power.json next to the config)")
+    parser.add_argument("--retune-hours", type=float,
+                        help="re-tune the IDW powers from the local store history at this interval")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    if args.trace:
+        METRICS.open_trace(args.trace)
+    subset = [name.strip() for name in args.stations.split(",")] if args.stations else None
+    registry = StationRegistry.from_config(args.config, subset=subset, output_sheet=args.output,
+                                           k_nearest=args.k_nearest, radius_km=args.radius_km,
+                                           max_age=args.max_age, stale_policy=args.stale)
+    backend = LocalBackend(args.data_dir) if args.backend == "local" else SheetsBackend(registry.credentials)
+    station_sheets, prediction_sheet = backend.open_sheets(registry)
+
+    tuning_file = args.tuning or default_tuning_path(args.config)
+    horizons = [] if args.forecast.lower() == "none" else [int(minutes) for minutes in args.forecast.split(",")]
+    # Interpolating needs a reading after the cycle time, so the cycle lags by one cadence
+    align_lag = args.align_lag if args.align_lag is not None else (
+        max(info['cadence'] for info in registry.stations.values()) if args.interpolate else 0)
+    predictor = WeatherPredictor(registry, station_sheets, prediction_sheet,
+                                 allow_partial_stations=args.allow_partial, min_stations=args.min_stations,
+                                 tuning_file=tuning_file, interpolate=args.interpolate, align_lag=align_lag,
+                                 forecast_horizons=horizons)
+    tuner = None
+    if args.retune_hours:
+        tuner = PowerTuner(registry, LocalBackend(args.data_dir), tuning_file)
+        tuner.start(args.retune_hours * 3600)
+    # Start the prediction loop
+    try:
+        predictor.update_predictions()
+    except KeyboardInterrupt:
+        print("\nPrediction process manually stopped.")
+    finally:
+        if tuner is not None:
+            tuner.close()
+        predictor.close()
+        backend.close()
+        METRICS.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# On-demand prediction service.
+#
+# Answers "what is the weather at (lat, lon)?" from a long-running process
+# instead of restarting a script and typing coordinates at the prompt:
+#
+#     service = PredictionService(predictor)
+#     service.update(latest_data)            # or service.start_polling()
+#     service.query(7.0195, 79.9002)
+#
+#     python query_service.py --port 8000
+#     curl "http://localhost:8000/predict?lat=7.0195&lon=79.9002"
+#     curl "http://localhost:8000/stats"
+#
+# Coordinates are snapped to a grid of QUANTUM degrees (about 11 m) and the
+# prediction for that grid point is kept in an LRU cache keyed by the snapped
+# coordinates and the station data version. Whenever any station value
+# changes, the version goes up and every cached entry is dropped.
+#
+# A cached answer is the prediction at the centre of the query's cell, up to
+# 8 m away, so it can differ from the exact point by as much as the IDW
+# surface changes over 8 m. The surface is steepest at a station, and with
+# powers below 1 (the tuner may pick 0.5) it has a cusp there: with WS1 at 28
+# and the other stations at 31, the centre of WS1's cell gives 28.56 at p=2
+# and 29.73 at p=0.5 for a query exactly on WS1. So cells holding a station
+# are never cached; queries there are predicted at the exact point. Elsewhere the answer is only an
+# approximation of the exact point, within the variation of the surface
+# across one cell; lower the quantum when that matters more than the hit rate.
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from scheduler import MIN_SLEEP
+
+# Size of the coordinate grid cached predictions are snapped to, in degrees
+QUANTUM = 1e-4
+
+# Number of cached predictions
+CACHE_SIZE = 4096
+
+# Number of recent query latencies kept for the percentiles
+LATENCY_WINDOW = 10_000
+
+
+class PredictionService:
+    def __init__(self, predictor, quantum=QUANTUM, cache_size=CACHE_SIZE):
+        self.predictor = predictor
+        self.quantum = quantum
+        self.cache_size = cache_size
+
+        self.lock = threading.Lock()
+        self.latest_data = {}
+        self.station_weights = {}
+        self.station_cells = set()  # cells holding a station, predicted exactly
+        self.version = 0
+        self.cache = OrderedDict()  # (lat index, lon index, version) -> predictions
+        self.hits = 0
+        self.misses = 0
+        self.exact = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stop_event = threading.Event()
+        self.poller = None
+
+    # Function to replace the station readings (and the weight factors of
+    # stale stations, see WeatherPredictor.align); bumps the version when any value changed
+    def update(self, latest_data, station_weights=None):
+        station_weights = dict(station_weights or {})
+        with self.lock:
+            if latest_data != self.latest_data or station_weights != self.station_weights:
+                self.latest_data = {name: dict(reading) for name, reading in latest_data.items()}
+                self.station_weights = station_weights
+                stations = self.predictor.registry.stations
+                self.station_cells = {self.quantize(stations[name]['latitude'], stations[name]['longitude'])
+                                      for name in latest_data}
+                self.version += 1
+                self.cache.clear()
+            return self.version
+
+    # Function to snap coordinates to the cache grid
+    def quantize(self, latitude, longitude):
+        return round(latitude / self.quantum), round(longitude / self.quantum)
+
+    # Function to answer a query, from the cache when possible
+    def query(self, latitude, longitude):
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("Invalid coordinates. Please enter valid latitude and longitude.")
+        start = time.perf_counter()
+        lat_index, lon_index = self.quantize(latitude, longitude)
+
+        with self.lock:
+            if not self.latest_data:
+                raise LookupError("No fresh station data available yet")
+            if (lat_index, lon_index) in self.station_cells:
+                # The surface is steep next to a station, so the cell centre is no answer here
+                self.exact += 1
+                target = {'latitude': latitude, 'longitude': longitude}
+                predictions = self.predictor.predict(self.latest_data, target, self.station_weights)
+            else:
+                key = (lat_index, lon_index, self.version)
+                predictions = self.cache.get(key)
+                if predictions is not None:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    # Predict at the grid point so every query in the cell gets the same answer
+                    target = {'latitude': lat_index * self.quantum, 'longitude': lon_index * self.quantum}
+                    predictions = self.predictor.predict(self.latest_data, target, self.station_weights)
+                    self.cache[key] = predictions
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+            version = self.version
+            self.latencies.append(time.perf_counter() - start)
+
+        return {'latitude': latitude, 'longitude': longitude, 'version': version, 'predictions': predictions}
+
+    # Function to report the cache hit rate and latency percentiles (in milliseconds)
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            total = self.hits + self.misses + self.exact
+            percentiles = (dict(zip(['p50_ms', 'p90_ms', 'p99_ms'], np.percentile(latencies, [50, 90, 99]).round(4).tolist()))
+                           if len(latencies) else {'p50_ms': None, 'p90_ms': None, 'p99_ms': None})
+            return {
+                'queries': total,
+                'hits': self.hits,
+                'misses': self.misses,
+                'exact': self.exact,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+                'cached_entries': len(self.cache),
+                'version': self.version,
+                **percentiles,
+            }
+
+    # Function to keep the station readings fresh from the predictor's stations on a background thread
+    def start_polling(self):
+        def poll():
+            latest_data = {}
+            scheduler = self.predictor.scheduler
+            while not self.stop_event.is_set():
+                due = scheduler.due_stations()
+                if due:
+                    # update() compares the aligned readings, so stations that went stale also bump the version
+                    self.predictor.poll_stations(due, latest_data)
+                    if self.predictor.ready(latest_data):
+                        # Stale readings are dropped or down-weighted like in the prediction loop
+                        data, weights = self.predictor.align(latest_data)
+                        if len(data) < self.predictor.min_stations:
+                            data, weights = {}, {}
+                        self.update(data, weights)
+                self.stop_event.wait(max(scheduler.time_until_next(), MIN_SLEEP))
+
+        self.poller = threading.Thread(target=poll, name="station-poller", daemon=True)
+        self.poller.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.poller is not None:
+            self.poller.join()
+
+
+# Function to build the HTTP handler class for a service
+def make_handler(service):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/stats":
+                self._send_json(200, service.stats())
+            elif url.path == "/predict":
+                query = parse_qs(url.query)
+                try:
+                    result = service.query(float(query['lat'][0]), float(query['lon'][0]))
+                    self._send_json(200, result)
+                except (KeyError, ValueError) as e:
+                    self._send_json(400, {'error': f"lat and lon must be valid numbers: {e}"})
+                except LookupError as e:
+                    self._send_json(503, {'error': str(e)})
+            else:
+                self._send_json(404, {'error': "Use /predict?lat=..&lon=.. or /stats"})
+
+        def log_message(self, format, *args):
+            pass  # keep the console for the prediction output
+
+    return PredictionHandler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve weather predictions for any location over HTTP.")
+    parser.add_argument("--config", help="station config file (JSON)")
+    parser.add_argument("--stations", help="comma separated subset of stations to use")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--quantum", type=float, default=QUANTUM, help="cache grid size in degrees (default: 1e-4, about 11 m)")
+    parser.add_argument("--backend", choices=["sheets", "local"], default="sheets")
+    parser.add_argument("--data-dir", default="data", help="directory of the local store (--backend local)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from predictor import DEFAULT_CONFIG, StationRegistry, WeatherPredictor
+    from power_tuner import default_tuning_path
+    from storage import SheetsBackend, LocalBackend
+
+    args = parse_args(argv)
+    subset = [name.strip() for name in args.stations.split(",")] if args.stations else None
+    config = args.config or DEFAULT_CONFIG
+    registry = StationRegistry.from_config(config, subset=subset)
+    backend = LocalBackend(args.data_dir) if args.backend == "local" else SheetsBackend(registry.credentials)
+    station_sheets = {name: backend.open_station(name, info) for name, info in registry.stations.items()}
+
+    predictor = WeatherPredictor(registry, station_sheets, None, tuning_file=default_tuning_path(config))
+    service = PredictionService(predictor, quantum=args.quantum)
+    service.start_polling()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving predictions on http://{args.host}:{args.port}/predict?lat=..&lon=..")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nPrediction service manually stopped.")
+    finally:
+        server.server_close()
+        service.close()
+        predictor.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Adaptive polling schedule for the weather stations.
+#
+# The prediction loop used to sleep a fixed 35 seconds after every cycle and a
+# fixed 10 seconds after any failure. AdaptiveScheduler keeps a due time per
+# station instead:
+#
+#   - every station is polled at its own cadence (from stations.json),
+#   - a station that answered with new rows is polled again after its cadence,
+#   - a station whose sheet had no new rows is polled again a little sooner,
+#     since its next reading is already late; if it stays silent, the delay
+#     doubles on every unchanged poll up to a few cadences, and goes back to
+#     the cadence as soon as new rows arrive,
+#   - a station that failed backs off exponentially with random jitter.
+#
+# Polling a station is a tail read (see sheet_tail.py), which returns nothing
+# when no rows were added, so checking for changes is cheap and a full
+# prediction cycle only runs when some station actually has new data.
+
+import random
+import time
+
+# Default seconds between two polls of a station
+DEFAULT_CADENCE = 35
+
+# A station with no new rows is polled again after this fraction of its cadence,
+# doubled on every further unchanged poll up to MAX_UNCHANGED_CADENCES cadences
+UNCHANGED_FACTOR = 0.5
+MAX_UNCHANGED_CADENCES = 4
+
+# Exponential backoff after failures
+BASE_BACKOFF = 10
+MAX_BACKOFF = 300
+
+# Random spread applied to every delay (0.2 = +/- 20 %)
+JITTER = 0.2
+
+# Never sleep less than this between two scheduler ticks
+MIN_SLEEP = 0.5
+
+# Stations due within this many seconds are polled together in one cycle
+DUE_WINDOW = 2
+
+
+class AdaptiveScheduler:
+    def __init__(self, cadences, default_cadence=DEFAULT_CADENCE, base_backoff=BASE_BACKOFF,
+                 max_backoff=MAX_BACKOFF, jitter=JITTER, clock=time.monotonic, sleep=time.sleep):
+        self.cadences = {name: cadence or default_cadence for name, cadence in cadences.items()}
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+
+        now = self.clock()
+        self.next_due = {name: now for name in self.cadences}  # every station is due at start
+        self.failures = {name: 0 for name in self.cadences}
+        self.unchanged = {name: 0 for name in self.cadences}  # polls in a row without new rows
+
+    # Function to spread a delay randomly so stations do not poll in lockstep
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    # Function to get the stations that should be polled now
+    def due_stations(self, window=DUE_WINDOW):
+        now = self.clock()
+        return [name for name, due in self.next_due.items() if due <= now + window]
+
+    # Function to record that a station was polled successfully
+    def record_success(self, name, changed):
+        self.failures[name] = 0
+        self.unchanged[name] = 0 if changed else self.unchanged[name] + 1
+        delay = self.cadences[name]
+        if not changed:
+            delay *= min(UNCHANGED_FACTOR * 2 ** (self.unchanged[name] - 1), MAX_UNCHANGED_CADENCES)
+        self.next_due[name] = self.clock() + self._jittered(delay)
+
+    # Function to record that polling a station failed; returns the backoff delay
+    def record_failure(self, name):
+        self.failures[name] += 1
+        delay = min(self.base_backoff * 2 ** (self.failures[name] - 1), self.max_backoff)
+        delay = self._jittered(delay)
+        self.next_due[name] = self.clock() + delay
+        return delay
+
+    # Function to get the number of seconds until the next station is due
+    def time_until_next(self):
+        if not self.next_due:
+            return DEFAULT_CADENCE
+        return max(min(self.next_due.values()) - self.clock(), 0)
+
+    # Function to sleep until the next station is due
+    def wait(self):
+        self.sleep(max(self.time_until_next(), MIN_SLEEP))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Incremental tail reader for the weather station sheets.
+#
+# The receiver (R.ino) appends a row to every WSx sheet every few seconds, so
+# reading the whole sheet with get_all_records() gets slower every day. This
+# reader remembers the last row index it has seen for each sheet and only
+# downloads the rows appended since then, which keeps the cost of a cycle
+# constant no matter how much history a sheet holds.
+
+from gspread.utils import rowcol_to_a1
+
+from metrics import METRICS
+
+# Number of probe cells used per round when searching for the last filled row
+PROBES_PER_ROUND = 64
+
+
+class SheetTailReader:
+    def __init__(self):
+        self.cursors = {}   # sheet title -> index of the last row already read
+        self.headers = {}   # sheet title -> header row
+        self.latest = {}    # sheet title -> last record read from the sheet
+
+    # Function to read the header row once and check it against the expected headers
+    def _load_headers(self, sheet, expected_headers):
+        header = sheet.row_values(1)
+        missing = [name for name in expected_headers if name not in header]
+        if missing:
+            raise ValueError(f"Missing headers in {sheet.title}: {missing}")
+        self.headers[sheet.title] = header
+        return header
+
+    # Function to get the current grid size of the sheet from its metadata
+    def _grid_rows(self, sheet):
+        metadata = sheet.spreadsheet.fetch_sheet_metadata()
+        for properties in (s['properties'] for s in metadata['sheets']):
+            if properties['sheetId'] == sheet.id:
+                return properties['gridProperties']['rowCount']
+        return sheet.row_count
+
+    # Function to find the last filled row without downloading the sheet.
+    # Rows are appended without gaps, so the filled rows form a prefix and the
+    # boundary can be found with a few rounds of batched single-cell probes.
+    def _find_last_row(self, sheet):
+        low = 1                            # header row, always filled
+        high = self._grid_rows(sheet) + 1  # first row past the grid
+
+        while high - low > 1:
+            count = min(PROBES_PER_ROUND, high - low - 1)
+            probes = sorted({low + (high - low) * (i + 1) // (count + 1) for i in range(count)})
+            results = sheet.batch_get([rowcol_to_a1(row, 1) for row in probes])
+            for row, result in zip(probes, results):
+                if result and result[0] and result[0][0] != '':
+                    low = row
+                else:
+                    high = row
+                    break
+
+        return low
+
+    # Function to turn a raw row into a record keyed by the header names
+    def _to_record(self, header, row):
+        row = list(row) + [''] * (len(header) - len(row))
+        return dict(zip(header, row))
+
+    # Function to read the rows appended since the last call and return the latest one
+    def read_latest(self, sheet, expected_headers):
+        title = sheet.title
+        header = self.headers.get(title) or self._load_headers(sheet, expected_headers)
+
+        if title not in self.cursors:
+            # First read: start just before the last row instead of at the top
+            with METRICS.span('sheet_probe', sheet=title):
+                self.cursors[title] = max(self._find_last_row(sheet) - 1, 1)
+
+        # Open-ended range: only the rows after the cursor are returned
+        cursor = self.cursors[title]
+        last_col = rowcol_to_a1(1, len(header)).rstrip('1')
+        with METRICS.span('sheet_read', sheet=title):
+            rows = sheet.get(f"A{cursor + 1}:{last_col}")
+
+        if rows:
+            METRICS.inc('rows_fetched_total', len(rows), sheet=title)
+            METRICS.inc('bytes_fetched_total', sum(len(str(cell).encode("utf-8")) for row in rows for cell in row),
+                        sheet=title)
+            self.cursors[title] = cursor + len(rows)
+            self.latest[title] = self._to_record(header, rows[-1])
+        return self.latest.get(title)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Fast start-up for the Google Sheets backend.
+#
+# The scripts authorized gspread and then called client.open("WS1") ...
+# client.open("preN") one after another at start-up. Each open() is a name
+# search through Drive followed by a metadata request, so several remote calls
+# were made before anything else could happen, and one transient error killed
+# the process. Here instead:
+#
+#   - every sheet is a LazyWorksheet that only opens the spreadsheet on first
+#     use, on whichever worker thread needs it first,
+#   - spreadsheets are opened by key. The name -> key mapping is cached in
+#     sheet_keys.json (or given as "key" in stations.json), so the Drive search
+#     only happens the first time a sheet is seen,
+#   - opening is retried with backoff on transient errors,
+#   - every sheet shares one authorized requests session with a connection
+#     pool sized for the fetch workers, and a background thread refreshes the
+#     access token before it expires, so no request waits for a token. Token
+#     requests go through a separate plain session (no Bearer header), and
+#     the session and the thread refresh under one lock, so the token is
+#     fetched once at start-up and never twice at the same time.
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from metrics import METRICS
+
+# File caching the sheet name -> spreadsheet key mapping, next to the credentials
+SHEET_KEYS_FILE = "sheet_keys.json"
+
+# Connections kept open to the Sheets API (one per fetch worker plus the writer)
+POOL_SIZE = 16
+
+# Refresh the access token this many seconds before it expires
+REFRESH_MARGIN = 300
+# Wait this long before trying again after a failed refresh
+REFRESH_RETRY = 30
+
+# Retries when opening a spreadsheet fails
+OPEN_RETRIES = 3
+OPEN_BACKOFF = 1.0
+
+
+class SheetKeyCache:
+    # Sheet name -> spreadsheet key, persisted as JSON
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.keys = json.load(f)
+        except (OSError, ValueError):
+            self.keys = {}
+
+    def get(self, name):
+        with self.lock:
+            return self.keys.get(name)
+
+    # Function to store (or with key=None forget) the key of a sheet
+    def set(self, name, key):
+        with self.lock:
+            if key is None:
+                self.keys.pop(name, None)
+            else:
+                self.keys[name] = key
+            temp_path = self.path + ".tmp"
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(self.keys, f, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Could not save {self.path}: {e}")
+
+
+class SharedCredentials:
+    # Credentials used by both the authorized session and the TokenRefresher.
+    # Every refresh, and every check for one before a request, holds the lock.
+    def __init__(self, credentials):
+        self._credentials = credentials
+        self._lock = threading.Lock()
+
+    def before_request(self, request, method, url, headers):
+        with self._lock:
+            self._credentials.before_request(request, method, url, headers)
+
+    def refresh(self, request):
+        with self._lock:
+            self._credentials.refresh(request)
+
+    # Function to refresh unless another request already did, less than
+    # margin seconds before expiry
+    def refresh_if_expiring(self, request, margin):
+        with self._lock:
+            if seconds_to_expiry(self._credentials) <= margin:
+                self._credentials.refresh(request)
+
+    def __getattr__(self, attribute):
+        return getattr(self._credentials, attribute)
+
+
+# Function to get the seconds until the token of some credentials expires (0 when there is none)
+def seconds_to_expiry(credentials):
+    expiry = credentials.expiry
+    if expiry is None:
+        return 0
+    # google-auth keeps expiry as naive UTC
+    return (expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+
+
+class TokenRefresher:
+    # Background thread refreshing the credentials REFRESH_MARGIN seconds before they expire.
+    # token_session is a plain requests session, not the authorized one.
+    def __init__(self, credentials, token_session, margin=REFRESH_MARGIN):
+        from google.auth.transport.requests import Request
+
+        self.credentials = credentials
+        self.request = Request(token_session)
+        self.margin = margin
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+        self.thread.start()
+
+    # Function to get the seconds until the token should be refreshed
+    def _time_to_refresh(self):
+        return seconds_to_expiry(self.credentials) - self.margin
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            delay = self._time_to_refresh()
+            if delay <= 0:
+                try:
+                    with METRICS.span('token_refresh'):
+                        self.credentials.refresh_if_expiring(self.request, self.margin)
+                    delay = max(self._time_to_refresh(), REFRESH_RETRY)
+                except Exception as e:
+                    print(f"Refreshing the Google access token failed: {e}")
+                    delay = REFRESH_RETRY
+            self.stop_event.wait(delay)
+
+    def close(self):
+        self.stop_event.set()
+
+
+# Function to mount a connection pool of pool_size connections on a requests session
+def _mount_pool(session, pool_size):
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+# Function to build the plain (unauthorized) session used for token requests
+def token_session():
+    import requests
+
+    return _mount_pool(requests.Session(), 2)
+
+
+# Function to build one authorized session with a connection pool shared by
+# every sheet. Its own refreshes go through tokens, a plain session.
+def pooled_session(credentials, tokens, pool_size=POOL_SIZE):
+    from google.auth.transport.requests import AuthorizedSession, Request
+
+    return _mount_pool(AuthorizedSession(credentials, auth_request=Request(tokens)), pool_size)
+
+
+class LazyWorksheet:
+    # First worksheet of a spreadsheet, opened on first use. The title is the
+    # spreadsheet name, so it is known (and unique per station) before opening.
+    def __init__(self, opener, name, key=None):
+        self._opener = opener
+        self._name = name
+        self._key = key
+        self._sheet = None
+        self._lock = threading.Lock()
+
+    @property
+    def title(self):
+        return self._name
+
+    # Function to open the spreadsheet once, on first use
+    def _open(self):
+        if self._sheet is None:
+            with self._lock:
+                if self._sheet is None:
+                    self._sheet = self._opener(self._name, self._key)
+        return self._sheet
+
+    def __getattr__(self, attribute):
+        return getattr(self._open(), attribute)
+
+
+# Function to open a spreadsheet by key, falling back to a search by name,
+# with retries on transient errors. Returns its first worksheet.
+def open_worksheet(client, key_cache, name, key=None):
+    import gspread
+
+    for attempt in range(OPEN_RETRIES + 1):
+        try:
+            with METRICS.span('open', sheet=name):
+                key = key or key_cache.get(name)
+                if key is not None:
+                    try:
+                        return client.open_by_key(key).sheet1
+                    except gspread.SpreadsheetNotFound:
+                        # Stale cache entry: forget it and search by name
+                        key_cache.set(name, None)
+                        key = None
+                spreadsheet = client.open(name)
+                key_cache.set(name, spreadsheet.id)
+                return spreadsheet.sheet1
+        except (gspread.SpreadsheetNotFound, PermissionError):
+            raise
+        except Exception as e:
+            if attempt == OPEN_RETRIES:
+                raise
+            delay = OPEN_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f"Opening {name} failed ({e}). Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
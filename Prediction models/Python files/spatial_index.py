@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Spatial index over the weather station coordinates.
+#
+# With hundreds of stations, weighting every station for every target costs
+# O(stations) per target and far-away nodes mostly add noise. StationIndex
+# lets IDW use only the k nearest stations and/or the stations within a
+# radius, for one target or a whole batch of targets.
+#
+# Stations are stored as points on the unit sphere, where the straight-line
+# (chord) distance grows with the haversine distance, so a KD-tree on those
+# points answers nearest-neighbour queries in O(log stations). scipy's cKDTree
+# is used when it is installed; otherwise the index falls back to a NumPy
+# brute-force search with the same results.
+
+import numpy as np
+
+from idw_engine import EARTH_RADIUS_KM
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional
+    cKDTree = None
+
+# Targets processed per block by the brute-force fallback, to bound memory
+BRUTE_FORCE_BLOCK = 4096
+
+
+# Function to convert latitude/longitude in degrees to points on the unit sphere
+def to_unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+# Function to convert a chord length on the unit sphere to a great-circle distance in km
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+# Function to convert a great-circle distance in km to a chord length on the unit sphere
+def km_to_chord(distance_km):
+    return 2 * np.sin(np.minimum(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class StationIndex:
+    def __init__(self, names, latitudes, longitudes):
+        self.names = list(names)
+        self.points = to_unit_vectors(latitudes, longitudes)
+        self.tree = cKDTree(self.points) if cKDTree is not None else None
+
+    # Function to build the index from a station dict (name -> coordinates)
+    @classmethod
+    def from_stations(cls, stations):
+        names = list(stations)
+        return cls(names,
+                   [stations[name]['latitude'] for name in names],
+                   [stations[name]['longitude'] for name in names])
+
+    def __len__(self):
+        return len(self.names)
+
+    # Function to find the k nearest stations of every target, optionally
+    # only within radius_km. Returns (distances in km, station indices), both
+    # of shape (targets, k); missing neighbours have an infinite distance and
+    # the index len(self).
+    def query(self, targets, k, radius_km=None):
+        targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+        points = to_unit_vectors(targets[:, 0], targets[:, 1])
+        k = min(k, len(self))
+        upper = km_to_chord(radius_km) if radius_km is not None else np.inf
+
+        if self.tree is not None:
+            # Small tolerance so a station exactly on the radius is kept
+            chords, indices = self.tree.query(points, k=k, distance_upper_bound=upper * (1 + 1e-9) if np.isfinite(upper) else np.inf)
+            chords = np.asarray(chords, dtype=float).reshape(len(points), k)
+            indices = np.asarray(indices).reshape(len(points), k)
+        else:
+            chords, indices = self._brute_force(points, k, upper)
+
+        distances = np.where(np.isfinite(chords), chord_to_km(np.where(np.isfinite(chords), chords, 0)), np.inf)
+        return distances, indices
+
+    # Function to find the nearest stations without scipy, block by block
+    def _brute_force(self, points, k, upper):
+        chords = np.empty((len(points), k))
+        indices = np.empty((len(points), k), dtype=int)
+        for start in range(0, len(points), BRUTE_FORCE_BLOCK):
+            block = points[start:start + BRUTE_FORCE_BLOCK]
+            d = np.linalg.norm(block[:, None, :] - self.points[None, :, :], axis=2)
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k] if k < len(self) else np.tile(np.arange(len(self)), (len(block), 1))
+            nearest_d = np.take_along_axis(d, nearest, axis=1)
+            order = np.argsort(nearest_d, axis=1, kind='stable')
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            nearest_d = np.take_along_axis(nearest_d, order, axis=1)
+            outside = nearest_d > upper * (1 + 1e-9)
+            nearest_d[outside] = np.inf
+            nearest[outside] = len(self)
+            chords[start:start + len(block)] = nearest_d
+            indices[start:start + len(block)] = nearest
+        return chords, indices
+
+    # Function to get the names of the stations used for a single target.
+    # If no station is within the radius, the nearest station is used.
+    def select(self, latitude, longitude, k=None, radius_km=None):
+        distances, indices = self.query([(latitude, longitude)], k or len(self), radius_km)
+        selected = [self.names[i] for i in indices[0] if i < len(self)]
+        if not selected:
+            _, nearest = self.query([(latitude, longitude)], 1)
+            selected = [self.names[nearest[0, 0]]]
+        return selected
+
+
+# Function to calculate raw IDW weights over each target's neighbours.
+# distances and indices come from StationIndex.query; a target that sits on a
+# station takes that station's value, and missing neighbours get weight 0.
+# factors (one per neighbour, same shape) scale the weights, e.g. to
+# down-weight stale readings.
+def raw_neighbor_weights(distances, p, factors=None):
+    on_station = distances == 0
+    with np.errstate(divide='ignore'):
+        weights = np.where(np.isfinite(distances), 1.0 / distances ** p, 0.0)
+    exact_rows = on_station.any(axis=1)
+    weights[exact_rows] = on_station[exact_rows]
+    if factors is not None:
+        weights *= factors
+    return weights
+
+
+# Function to calculate normalized IDW weights over each target's neighbours;
+# a target with no neighbour gets NaN
+def neighbor_weights(distances, p, factors=None):
+    weights = raw_neighbor_weights(distances, p, factors)
+    with np.errstate(invalid='ignore'):
+        return weights / weights.sum(axis=1, keepdims=True)
+
+
+# Function to look up the weight factor of every neighbour; padded neighbours get 0
+def neighbor_factors(indices, factors):
+    if factors is None:
+        return None
+    return np.append(np.asarray(factors, dtype=float), 0.0)[indices]
+
+
+# Function to calculate IDW estimates for many targets from their neighbours only.
+# values has shape (stations, params); the result has shape (targets, params).
+# factors optionally holds a weight factor per station.
+def idw_neighbors_estimate(index, targets, values, p, k=8, radius_km=None, decimals=2, factors=None):
+    distances, indices = index.query(targets, k, radius_km)
+    weights = neighbor_weights(distances, p, neighbor_factors(indices, factors))
+
+    # Padded neighbours point one past the last station and get zero weight
+    values = np.asarray(values, dtype=float)
+    padded = np.vstack([values, np.zeros((1, values.shape[1]))])
+    estimates = np.einsum('tk,tkp->tp', weights, padded[indices])
+    return np.round(estimates, decimals) if decimals is not None else estimates
+
+
+# Function to pick the category with the largest summed weight among each
+# target's neighbours. codes holds the category code of every station. As in
+# idw_engine.weighted_vote, the weights are summed in station order and ties
+# go to the category seen first in station order among the neighbours.
+def idw_neighbors_vote(index, targets, codes, p, k=8, radius_km=None, factors=None):
+    distances, indices = index.query(targets, k, radius_km)
+    weights = raw_neighbor_weights(distances, p, neighbor_factors(indices, factors))
+
+    # Neighbours in station order instead of distance order; padded ones (index len(index)) come last
+    order = np.argsort(indices, axis=1, kind='stable')
+    indices = np.take_along_axis(indices, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+
+    codes = np.asarray(codes, dtype=np.intp)
+    padded = np.append(codes, 0)  # padded neighbours have zero weight
+    rows = np.arange(len(indices))
+    scores = np.zeros((len(indices), codes.max() + 1))
+    first_seen = np.full(scores.shape, np.iinfo(np.intp).max)
+    for column in range(indices.shape[1]):
+        category = padded[indices[:, column]]
+        scores[rows, category] += weights[:, column]
+        first_seen[rows, category] = np.minimum(first_seen[rows, category], indices[:, column])
+
+    # Among the categories with the top score, the one seen first in station order wins
+    top = scores == scores.max(axis=1, keepdims=True)
+    return np.argmin(np.where(top, first_seen, np.iinfo(np.intp).max), axis=1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Concurrent fetching of the weather station readings.
+#
+# Every station sheet is read on its own worker thread with a per-station
+# timeout, so the time of a cycle is set by the slowest station instead of the
+# sum of all of them. Readings that were fetched successfully are kept while
+# the failed stations are retried.
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import METRICS
+
+# Seconds to wait for a single station before giving up on it for this attempt
+STATION_TIMEOUT = 15
+
+
+# Function to turn a raw sheet record into numerical and categorical values
+def parse_station_entry(entry):
+    return {
+        'Temperature': float(entry['Temperature'].replace('C', '').strip()),
+        'Humidity': float(entry['Humidity'].replace('%', '').strip()),
+        'Air Pressure': float(entry['Air Pressure'].replace('hPa', '').strip()),
+        'Air Quality': entry['Air Quality'].strip(),
+        'Rain Status': entry['Rain Status'].strip()
+    }
+
+
+class StationFetcher:
+    def __init__(self, fetch_fn, max_workers=8, timeout=STATION_TIMEOUT):
+        self.fetch_fn = fetch_fn
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="station-fetch")
+        self.pending = {}  # location -> request still running from an earlier attempt
+
+    # Function to fetch and parse the reading of one station (runs on a worker thread)
+    def _fetch_station(self, sheet):
+        latest_entry = self.fetch_fn(sheet)
+        if not latest_entry:
+            raise LookupError("no data available")
+        with METRICS.span('parse', sheet=sheet.title):
+            try:
+                return parse_station_entry(latest_entry)
+            except (ValueError, KeyError, AttributeError):
+                METRICS.inc('parse_failures_total', sheet=sheet.title)
+                raise
+
+    # Function to fetch every station that is not yet in latest_data.
+    # Successful readings are added to latest_data and the locations that are
+    # still missing are returned.
+    def fetch_missing(self, sheets, latest_data):
+        for location, sheet in sheets.items():
+            if location not in latest_data and location not in self.pending:
+                self.pending[location] = self.executor.submit(self._fetch_station, sheet)
+
+        futures = {self.pending[location]: location for location in sheets if location in self.pending}
+        done, _ = wait(futures, timeout=self.timeout)
+
+        for future in done:
+            location = futures[future]
+            del self.pending[location]
+            try:
+                latest_data[location] = future.result()
+            except Exception as e:
+                print(f"[{location}] Data unavailable: {e}")
+
+        # Requests that timed out stay pending and are picked up by the next attempt
+        for location in self.pending:
+            if location in sheets:
+                print(f"[{location}] No answer within {self.timeout} seconds")
+
+        return [location for location in sheets if location not in latest_data]
+
+    # Function to stop the worker threads
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
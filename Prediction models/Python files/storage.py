@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Storage backends for station readings and predictions.
+#
+# The predictor reads the stations and writes its predictions through a
+# StorageBackend, which hands out worksheet handles:
+#
+#   SheetsBackend  - the Google Sheets used so far (WSx / preN)
+#   LocalBackend   - a local append-only columnar store, one directory per
+#                    sheet and one binary file per field, read back through
+#                    np.memmap. LocalWorksheet mimics the parts of the gspread
+#                    Worksheet API the predictor uses, so the prediction loop
+#                    can run fully offline.
+#
+# Time-range scans (LocalBackend.scan) read only the requested slice of each
+# field and return NumPy arrays, so history can be analysed without exporting
+# CSVs from the sheets by hand.
+
+import csv
+import os
+import re
+import sys
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from bulk_parser import CATEGORY_CODES, TIMESTAMP_FORMATS, parse_numeric_column, parse_timestamp_column
+from metrics import METRICS
+from prediction_writer import BufferedSheetWriter
+from sheets_session import (SHEET_KEYS_FILE, LazyWorksheet, SharedCredentials, SheetKeyCache, TokenRefresher, open_worksheet,
+                            pooled_session, token_session)
+
+# Define expected headers
+WS_EXPECTED_HEADERS = ['Date', 'Time', 'Temperature', 'Humidity', 'Air Pressure', 'Air Quality', 'Rain Status']
+PD_EXPECTED_HEADERS = ['Date', 'Time', 'Latitude', 'Longitude', 'Temperature', 'Humidity', 'Air Pressure', 'Air Quality', 'Rain Status']
+
+# Field types: numerical fields keep the unit the sheets show after the value,
+# every other field is stored as an integer code into a per-field vocabulary
+WS_NUMERIC_UNITS = {'Temperature': 'C', 'Humidity': '%', 'Air Pressure': 'hPa'}
+PD_NUMERIC_UNITS = {'Latitude': '', 'Longitude': '', 'Temperature': '', 'Humidity': '', 'Air Pressure': ''}
+
+# Token written by the transmitters (WSx.ino) when a sensor cannot be read
+ERROR_TOKEN = 'Error'
+
+# File in every table directory that writers lock while appending
+LOCK_FILE = "append.lock"
+
+
+# Function to turn the Date and Time cells of a row into a POSIX timestamp.
+# Tries bulk_parser.TIMESTAMP_FORMATS; returns default (NaN) when none matches.
+def parse_timestamp(date_str, time_str, default=float('nan')):
+    text = f"{date_str} {time_str}".strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    return default
+
+
+# Function to turn naive datetime64 values (local time, as parse_timestamp
+# reads them) into POSIX timestamps; NaT becomes NaN. The UTC offset is looked
+# up once per distinct hour instead of once per value.
+def local_timestamps(values):
+    result = np.full(len(values), np.nan)
+    ok = ~np.isnat(values)
+    if not ok.any():
+        return result
+    seconds = values[ok].astype('datetime64[s]').astype(np.int64)
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    offsets = np.array([(datetime(1970, 1, 1) + timedelta(hours=int(hour))).timestamp() - hour * 3600
+                        for hour in hours])
+    result[ok] = seconds + offsets[inverse.reshape(-1)]
+    return result
+
+
+# Function to hold an exclusive lock on a file, shared with other processes
+@contextmanager
+def file_lock(path):
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Function to read a numerical cell such as "28.5C"; unreadable cells become NaN
+def parse_number(cell, unit=''):
+    if isinstance(cell, (int, float)):
+        return float(cell)
+    text = str(cell).strip()
+    if unit and text.endswith(unit):
+        text = text[:-len(unit)]
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+
+# Function to write a stored number back the way the sheets show it
+def format_number(value, unit=''):
+    if np.isnan(value):
+        return ERROR_TOKEN
+    return f"{value:.10g}{unit}"
+
+
+class ColumnarTable:
+    # One append-only table: a directory holding a raw binary file per field
+    # (float64 for numbers, int32 codes for text) plus a timestamp column.
+    # A new vocabulary of a categorical field starts with its code table from
+    # bulk_parser, so stored codes match the bulk parser and the IDW engine.
+    # Several processes may append to one table: writers take LOCK_FILE and
+    # re-read the vocabularies first, so a new value gets the same code in
+    # every process. Readers need no lock.
+    def __init__(self, directory, header, numeric_units, categories=CATEGORY_CODES):
+        self.directory = directory
+        self.header = list(header)
+        self.numeric_units = numeric_units
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Text vocabularies: one value per line, the line number is the code
+        self.vocab = {name: [] for name in self.text_fields()}
+        self.codes = {name: {} for name in self.text_fields()}
+        self.vocab_bytes = {name: 0 for name in self.text_fields()}
+        self.rows = 0
+        with self.lock, file_lock(os.path.join(directory, LOCK_FILE)):
+            self.refresh()
+            for name, codes in categories.items():
+                if name in self.vocab and not self.vocab[name]:
+                    self._codes(name, sorted(codes, key=codes.get))
+
+    # Function to pick up rows and vocabulary values appended by another
+    # backend or process since the last call. Returns the row count.
+    def refresh(self):
+        with self.lock:
+            # Rows only count once every field has been written. Their values
+            # were added to the vocabularies before, so count them first.
+            rows = min(self._field_rows(name) for name in ['timestamp'] + self.header)
+            for name in self.vocab:
+                path = self._vocab_path(name)
+                if not os.path.exists(path) or os.path.getsize(path) <= self.vocab_bytes[name]:
+                    continue
+                with open(path, "rb") as f:
+                    f.seek(self.vocab_bytes[name])
+                    data = f.read()
+                # Only complete lines; a value still being written is picked up next time
+                complete = data[:data.rfind(b"\n") + 1]
+                for line in complete.decode("utf-8").splitlines():
+                    self.codes[name].setdefault(line, len(self.vocab[name]))
+                    self.vocab[name].append(line)
+                self.vocab_bytes[name] += len(complete)
+            self.rows = rows
+            return self.rows
+
+    def text_fields(self):
+        return [name for name in self.header if name not in self.numeric_units]
+
+    def _file_name(self, name):
+        return re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_').lower()
+
+    def _field_path(self, name):
+        suffix = 'i4' if name in self.vocab else 'f8'
+        return os.path.join(self.directory, f"{self._file_name(name)}.{suffix}")
+
+    def _vocab_path(self, name):
+        return os.path.join(self.directory, f"{self._file_name(name)}.vocab")
+
+    def _dtype(self, name):
+        return np.int32 if name in self.vocab else np.float64
+
+    def _field_rows(self, name):
+        path = self._field_path(name)
+        return os.path.getsize(path) // np.dtype(self._dtype(name)).itemsize if os.path.exists(path) else 0
+
+    # Function to get the codes of text values, adding the new ones to the
+    # vocabulary with a single write
+    def _codes(self, name, values):
+        codes = self.codes[name]
+        lines = []
+        for value in values:
+            if value not in codes:
+                codes[value] = len(self.vocab[name])
+                self.vocab[name].append(value)
+                lines.append(value.replace("\n", " ") + "\n")
+        if lines:
+            data = "".join(lines).encode("utf-8")
+            with open(self._vocab_path(name), "ab") as f:
+                f.write(data)
+            self.vocab_bytes[name] += len(data)
+        return np.array([codes[value] for value in values], dtype=np.int32)
+
+    # Function to append rows given as lists of cells in header order.
+    # Every column is parsed at once with the bulk parser. Scans rely on the
+    # timestamps being in order, so the rows are stored sorted by time, and
+    # rows whose Date/Time cannot be read or that are older than the last
+    # stored row are not stored. Returns the number of rows stored.
+    def append_rows(self, rows):
+        width = len(self.header)
+        rows = [list(row[:width]) + [''] * (width - len(row)) if len(row) != width else row for row in rows]
+        if not rows:
+            return 0
+        table = np.array(rows, dtype=str)  # one conversion for the whole batch
+        columns = {name: table[:, i] for i, name in enumerate(self.header)}
+        values, _ = parse_timestamp_column(columns['Date'], columns['Time'])
+        timestamps = local_timestamps(values)
+        keep = ~np.isnan(timestamps)
+        if not keep.any():
+            return 0
+
+        with self.lock, file_lock(os.path.join(self.directory, LOCK_FILE)):
+            self.refresh()
+            if self.rows:
+                last = self._map_field('timestamp', self.rows - 1)[0]
+                older = keep & (timestamps < last)
+                if older.any():
+                    print(f"Skipped {np.count_nonzero(older)} rows older than the last row stored in {self.directory}")
+                    keep &= ~older
+            order = np.flatnonzero(keep)
+            order = order[np.argsort(timestamps[order], kind='stable')]
+            if not len(order):
+                return 0
+
+            fields = {'timestamp': timestamps[order]}
+            for name in self.header:
+                cells = columns[name][order]
+                if name in self.numeric_units:
+                    fields[name] = parse_numeric_column(cells, self.numeric_units[name])[0]
+                else:
+                    uniques, inverse = np.unique(np.char.strip(cells), return_inverse=True)
+                    fields[name] = self._codes(name, uniques.tolist())[inverse.reshape(-1)]
+
+            # Drop a half-written row left by an interrupted append first
+            for name in ['timestamp'] + self.header:
+                path = self._field_path(name)
+                with open(path, "ab") as f:
+                    f.truncate(self.rows * np.dtype(self._dtype(name)).itemsize)
+                    f.write(np.asarray(fields[name], dtype=self._dtype(name)).tobytes())
+            self.rows += len(fields['timestamp'])
+            return len(fields['timestamp'])
+
+    # Function to map a field read-only for rows [start, stop)
+    def read_field(self, name, start=0, stop=None):
+        self.refresh()
+        return self._map_field(name, start, stop)
+
+    def _map_field(self, name, start=0, stop=None):
+        stop = self.rows if stop is None else min(stop, self.rows)
+        if stop <= start:
+            return np.empty(0, dtype=self._dtype(name))
+        data = np.memmap(self._field_path(name), dtype=self._dtype(name), mode='r', shape=(self.rows,))
+        return data[start:stop]
+
+    # Function to decode text codes back into strings
+    def decode(self, name, codes):
+        vocab = self.vocab[name]
+        return [vocab[code] for code in codes]
+
+    # Function to read rows [start, stop) as lists of cells like the sheets show them
+    def read_rows(self, start, stop):
+        with self.lock:
+            stop = min(stop, self.refresh())
+            if stop <= start:
+                return []
+            columns = []
+            for name in self.header:
+                values = self._map_field(name, start, stop)
+                if name in self.vocab:
+                    columns.append(self.decode(name, values))
+                else:
+                    unit = self.numeric_units[name]
+                    columns.append([format_number(value, unit) for value in values])
+            return [list(row) for row in zip(*columns)]
+
+    # Function to find the rows with start <= timestamp < end.
+    # Rows are appended in time order, so a binary search finds the slice.
+    def time_range(self, start=None, end=None):
+        with self.lock:
+            timestamps = self.read_field('timestamp')
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+            return first, last
+
+    # Function to scan a time range and return every field as a NumPy array.
+    # Text fields are returned as integer codes unless decode=True.
+    def scan(self, start=None, end=None, fields=None, decode=False):
+        with self.lock:
+            first, last = self.time_range(start, end)
+            result = {'timestamp': np.array(self._map_field('timestamp', first, last))}
+            for name in fields or self.header:
+                values = np.array(self._map_field(name, first, last))
+                result[name] = np.array(self.decode(name, values), dtype=object) if decode and name in self.vocab else values
+            return result
+
+
+class LocalSpreadsheet:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def fetch_sheet_metadata(self):
+        return {'sheets': [{'properties': {
+            'sheetId': self.worksheet.id,
+            'title': self.worksheet.title,
+            'gridProperties': {'rowCount': self.worksheet.row_count, 'columnCount': self.worksheet.col_count}
+        }}]}
+
+
+class LocalWorksheet:
+    # Stand-in for gspread.Worksheet backed by a ColumnarTable. Row 1 is the
+    # header row and data row r is table row r - 2, as in the sheets.
+    id = 0
+
+    def __init__(self, title, table):
+        self.title = title
+        self.table = table
+        self.spreadsheet = LocalSpreadsheet(self)
+
+    @property
+    def row_count(self):
+        return self.table.refresh() + 1
+
+    @property
+    def col_count(self):
+        return len(self.table.header)
+
+    # Function to read a sheet row the way gspread returns it
+    def row_values(self, row):
+        if row == 1:
+            return list(self.table.header)
+        rows = self.table.read_rows(row - 2, row - 1)
+        return rows[0] if rows else []
+
+    # Function to read an A1 range such as "A5:G", "A5:G9" or "A5"
+    def get(self, range_name):
+        match = re.fullmatch(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?", range_name.split('!')[-1])
+        if not match:
+            raise ValueError(f"Unsupported range: {range_name}")
+        first_col, first_row, last_col, last_row = match.groups()
+        first_row = int(first_row)
+        last_row = int(last_row) if last_row else (first_row if last_col is None else self.row_count)
+        col_start = self._col_index(first_col)
+        col_stop = self._col_index(last_col or first_col) + 1
+
+        rows = []
+        if first_row <= 1 <= last_row:
+            rows.append(self.table.header)
+        rows += self.table.read_rows(max(first_row, 2) - 2, last_row - 1)
+        return [row[col_start:col_stop] for row in rows]
+
+    def batch_get(self, ranges):
+        return [self.get(range_name) for range_name in ranges]
+
+    def _col_index(self, letters):
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - ord('A') + 1
+        return index - 1
+
+    def get_all_records(self, expected_headers=None):
+        return [dict(zip(self.table.header, row)) for row in self.table.read_rows(0, self.table.refresh())]
+
+    def append_row(self, values, **kwargs):
+        self.table.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self.table.append_rows(values)
+
+
+class StorageBackend(ABC):
+    # Where the predictor reads station readings from and writes predictions to
+
+    # Function to get the worksheet handle of a station
+    @abstractmethod
+    def open_station(self, name, info):
+        ...
+
+    # Function to get the worksheet handle of a prediction sheet
+    @abstractmethod
+    def open_predictions(self, sheet_name):
+        ...
+
+    # Function to open every station of a registry and its prediction sheet
+    def open_sheets(self, registry):
+        station_sheets = {name: self.open_station(name, info) for name, info in registry.stations.items()}
+        return station_sheets, self.open_predictions(registry.output_sheet)
+
+    # Function to release connections and background threads
+    def close(self):
+        pass
+
+
+class SheetsBackend(StorageBackend):
+    # Google Sheets, one spreadsheet per station and per prediction sheet.
+    # Handles are LazyWorksheets opened by key on first use, over one shared
+    # authorized session (see sheets_session.py).
+    SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+    def __init__(self, credentials, key_file=None):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        with METRICS.span('auth'):
+            creds = SharedCredentials(Credentials.from_service_account_file(credentials, scopes=self.SCOPE))
+            self.tokens = token_session()
+            self.session = pooled_session(creds, self.tokens)
+            self.client = gspread.Client(creds, session=self.session)
+        self.refresher = TokenRefresher(creds, self.tokens)
+        self.keys = SheetKeyCache(key_file or os.path.join(os.path.dirname(os.path.abspath(credentials)), SHEET_KEYS_FILE))
+        self.writers = {}  # station sheet -> BufferedSheetWriter of the readings received for it
+        self.lock = threading.Lock()
+
+    # Function to open the first worksheet of a spreadsheet (called on first use of a handle)
+    def _open(self, sheet_name, key):
+        return open_worksheet(self.client, self.keys, sheet_name, key)
+
+    def open_station(self, name, info):
+        return LazyWorksheet(self._open, info.get('sheet', name), info.get('key'))
+
+    def open_predictions(self, sheet_name):
+        return LazyWorksheet(self._open, sheet_name)
+
+    # Function to append one station reading (a record or a row of cells) to
+    # its sheet, the way the Apps Script of the receiver node does. Rows are
+    # written behind in batches; rows still unsent on close go to a CSV file.
+    def append_reading(self, sheet_name, reading):
+        with self.lock:
+            writer = self.writers.get(sheet_name)
+            if writer is None:
+                writer = self.writers[sheet_name] = BufferedSheetWriter(
+                    LazyWorksheet(self._open, sheet_name), unsent_rows_file=f"unsent_{sheet_name}.csv",
+                    name=f"{sheet_name}-writer")
+        row = [reading.get(name, '') for name in WS_EXPECTED_HEADERS] if isinstance(reading, dict) else reading
+        writer.append_row(row)
+
+    def close(self):
+        with self.lock:
+            writers, self.writers = list(self.writers.values()), {}
+        for writer in writers:
+            writer.close()
+        self.refresher.close()
+        self.session.close()
+        self.tokens.close()
+
+
+class LocalBackend(StorageBackend):
+    # Local columnar store: <directory>/<sheet name>/<field>.f8|.i4
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    # Function to get (or create) the table of a sheet
+    def table(self, sheet_name, predictions=False):
+        with self.lock:
+            if sheet_name not in self.tables:
+                header, units = (PD_EXPECTED_HEADERS, PD_NUMERIC_UNITS) if predictions else (WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+                self.tables[sheet_name] = ColumnarTable(os.path.join(self.directory, sheet_name), header, units)
+            return self.tables[sheet_name]
+
+    def open_station(self, name, info):
+        sheet_name = info.get('sheet', name)
+        return LocalWorksheet(sheet_name, self.table(sheet_name))
+
+    def open_predictions(self, sheet_name):
+        return LocalWorksheet(sheet_name, self.table(sheet_name, predictions=True))
+
+    # Function to store one station reading given as a record or a row of cells
+    def append_reading(self, sheet_name, reading):
+        table = self.table(sheet_name)
+        row = [reading.get(name, '') for name in table.header] if isinstance(reading, dict) else reading
+        table.append_rows([row])
+
+    # Function to scan a station or prediction sheet between two timestamps
+    def scan(self, sheet_name, start=None, end=None, fields=None, decode=False, predictions=False):
+        return self.table(sheet_name, predictions).scan(start, end, fields, decode)
+
+
+# Function to import a CSV export of a sheet into the local store.
+# Returns (rows imported, rows skipped because their Date/Time could not be read
+# or they are older than the rows already stored).
+def import_csv(backend, sheet_name, path, predictions=False):
+    table = backend.table(sheet_name, predictions)
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        if columns[:len(table.header)] == table.header:
+            rows = list(reader)
+        else:
+            # Columns in the order of the table header; missing ones are left blank
+            indices = [columns.index(name) if name in columns else None for name in table.header]
+            rows = [[row[i] if i is not None and i < len(row) else '' for i in indices] for row in reader]
+    imported = table.append_rows(rows)
+    return imported, len(rows) - imported
+
+
+# Usage: python storage.py import <data dir> <sheet name> <file.csv> [--predictions]
+#        python storage.py export <data dir> <sheet name> <file.csv> [--predictions]
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or sys.argv[1] not in ("import", "export"):
+        print("Usage: python storage.py import|export <data dir> <sheet name> <file.csv> [--predictions]")
+        sys.exit(1)
+    command, directory, sheet_name, path = sys.argv[1:5]
+    is_prediction = "--predictions" in sys.argv[5:]
+    backend = LocalBackend(directory)
+
+    if command == "import":
+        count, skipped = import_csv(backend, sheet_name, path, is_prediction)
+        print(f"Imported {count} rows into {sheet_name}")
+        if skipped:
+            print(f"Skipped {skipped} rows with an unreadable Date/Time or older than the stored rows")
+    else:
+        table = backend.table(sheet_name, is_prediction)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(table.header)
+            writer.writerows(table.read_rows(0, table.rows))
+        print(f"Exported {table.rows} rows from {sheet_name}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Checks that the batched IDW engine gives the same predictions as the
+# original one-target-at-a-time functions of 2_Nodes.py .. 4_Nodes.py, which
+# are kept below as reference copies (with the power as an argument instead
+# of a global).
+#
+#     python -m pytest test_idw_engine.py
+
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+import pytest
+
+from idw_engine import IDWWeightCache, CategoryEncoder, NUMERIC_PARAMS, CATEGORICAL_PARAMS, \
+    haversine_matrix, idw_weights, predict_numeric, weighted_vote
+from spatial_index import StationIndex, idw_neighbors_vote
+
+AIR_QUALITY = ['Good', 'Moderate', 'Poor']
+RAIN_STATUS = ['Not raining', 'Light rain', 'Raining']
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    R = 6371.0
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    return R * c
+
+
+def calculate_idw_prediction(latest_data, distances, param, p):
+    weighted_sum = 0
+    weight_sum = 0
+    for location, distance in distances.items():
+        value = latest_data[location][param]
+        weight = 1 / (distance ** p)
+        weighted_sum += value * weight
+        weight_sum += weight
+    return round(weighted_sum / weight_sum, 2)
+
+
+def predict_categorical(latest_data, distances, param, p):
+    weights = {}
+    for location, distance in distances.items():
+        category = latest_data[location][param]
+        weight = 1 / (distance ** p)
+        weights[category] = weights.get(category, 0) + weight
+    return max(weights, key=weights.get)
+
+
+# Function to generate stations, readings and targets around the experiment site
+def random_layout(rng, station_count, target_count):
+    stations = {f"WS{i + 1}": {'latitude': 7.0195 + rng.uniform(-0.01, 0.01),
+                               'longitude': 79.9002 + rng.uniform(-0.01, 0.01)}
+                for i in range(station_count)}
+    latest_data = {name: {'Temperature': round(rng.uniform(24, 34), 2), 'Humidity': round(rng.uniform(50, 95), 2),
+                          'Air Pressure': round(rng.uniform(1000, 1015), 2),
+                          'Air Quality': AIR_QUALITY[rng.integers(3)], 'Rain Status': RAIN_STATUS[rng.integers(3)]}
+                   for name in stations}
+    targets = np.column_stack([7.0195 + rng.uniform(-0.01, 0.01, target_count),
+                               79.9002 + rng.uniform(-0.01, 0.01, target_count)])
+    return stations, latest_data, targets
+
+
+# Function to predict one target the way the original scripts did
+def reference_prediction(stations, latest_data, target, p):
+    distances = {name: calculate_distance(info['latitude'], info['longitude'], target[0], target[1])
+                 for name, info in stations.items()}
+    prediction = {param: calculate_idw_prediction(latest_data, distances, param, p) for param in NUMERIC_PARAMS}
+    prediction.update({param: predict_categorical(latest_data, distances, param, p) for param in CATEGORICAL_PARAMS})
+    return prediction
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batched_predictions_match_the_original_functions(seed):
+    rng = np.random.default_rng(seed)
+    stations, latest_data, targets = random_layout(rng, int(rng.integers(2, 12)), 15)
+    p = float(rng.choice([1, 2, 3]))
+
+    numeric = predict_numeric(stations, latest_data, targets, p)
+    cache = IDWWeightCache()
+    cached = cache.predict(stations, latest_data, targets, p)
+    votes = {param: cache.vote(stations, latest_data, targets, p, param) for param in CATEGORICAL_PARAMS}
+
+    for t, target in enumerate(targets):
+        expected = reference_prediction(stations, latest_data, target, p)
+        for param in NUMERIC_PARAMS:
+            assert numeric[param][t] == expected[param]
+            assert cached[param][t] == expected[param]
+        for param in CATEGORICAL_PARAMS:
+            assert votes[param][t] == expected[param]
+
+
+def test_cached_predictions_follow_station_updates():
+    rng = np.random.default_rng(1)
+    stations, latest_data, targets = random_layout(rng, 6, 10)
+    cache = IDWWeightCache()
+
+    # Each cycle one station reports a new temperature; the cache corrects its estimates
+    for cycle in range(50):
+        name = f"WS{cycle % 6 + 1}"
+        latest_data[name] = dict(latest_data[name], Temperature=round(rng.uniform(24, 34), 2))
+        cached = cache.predict(stations, latest_data, targets, 2)
+        for t, target in enumerate(targets):
+            assert cached['Temperature'][t] == reference_prediction(stations, latest_data, target, 2)['Temperature']
+
+
+def test_target_on_a_station_takes_its_reading():
+    # The original functions divided by zero here
+    rng = np.random.default_rng(2)
+    stations, latest_data, _ = random_layout(rng, 4, 0)
+    target = np.array([[stations['WS3']['latitude'], stations['WS3']['longitude']]])
+
+    numeric = predict_numeric(stations, latest_data, target, 2)
+    cache = IDWWeightCache()
+    for param in NUMERIC_PARAMS:
+        assert numeric[param][0] == latest_data['WS3'][param]
+    for param in CATEGORICAL_PARAMS:
+        assert cache.vote(stations, latest_data, target, 2, param)[0] == latest_data['WS3'][param]
+
+
+def test_ties_go_to_the_category_seen_first_in_station_order():
+    # Stations in pairs north and south of the target, so each category gets
+    # exactly the same summed weight
+    stations = {'WS1': {'latitude': 7.001, 'longitude': 80.0}, 'WS2': {'latitude': 6.999, 'longitude': 80.0},
+                'WS3': {'latitude': 7.002, 'longitude': 80.0}, 'WS4': {'latitude': 6.998, 'longitude': 80.0}}
+    target = np.array([[7.0, 80.0]])
+    for order in (['Poor', 'Good', 'Good', 'Poor'], ['Good', 'Poor', 'Poor', 'Good']):
+        latest_data = {name: {'Air Quality': category} for name, category in zip(stations, order)}
+        distances = {name: calculate_distance(info['latitude'], info['longitude'], 7.0, 80.0)
+                     for name, info in stations.items()}
+        expected = predict_categorical(latest_data, distances, 'Air Quality', 2)
+        assert expected == order[0]
+        assert IDWWeightCache().vote(stations, latest_data, target, 2, 'Air Quality')[0] == expected
+
+        # The k-nearest vote breaks ties the same way
+        encoder = CategoryEncoder.for_param('Air Quality')
+        codes = encoder.encode_many(latest_data[name]['Air Quality'] for name in stations)
+        index = StationIndex.from_stations(stations)
+        assert encoder.decode(idw_neighbors_vote(index, target, codes, 2, k=4)) == [expected]
+
+
+def test_weighted_vote_matches_the_k_nearest_vote():
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        stations, latest_data, targets = random_layout(rng, 8, 20)
+        names = list(stations)
+        codes = CategoryEncoder.for_param('Rain Status').encode_many(latest_data[name]['Rain Status'] for name in names)
+        distances = haversine_matrix(targets[:, 0], targets[:, 1],
+                                     [stations[name]['latitude'] for name in names],
+                                     [stations[name]['longitude'] for name in names])
+        index = StationIndex.from_stations(stations)
+        assert np.array_equal(weighted_vote(idw_weights(distances, 2), codes),
+                              idw_neighbors_vote(index, targets, codes, 2, k=len(names)))
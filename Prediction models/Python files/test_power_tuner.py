@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Checks of the background re-tuning in power_tuner.py.
+#
+#     python -m pytest test_power_tuner.py
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from idw_engine import haversine_matrix
+from power_tuner import PowerTuner, tune
+from predictor import StationRegistry
+from storage import LocalBackend
+
+STATIONS = {
+    'WS1': {'latitude': 7.0193689, 'longitude': 79.9001577, 'sheet': 'WS1'},
+    'WS2': {'latitude': 7.0193110, 'longitude': 79.9002777, 'sheet': 'WS2'},
+    'WS3': {'latitude': 7.0197988, 'longitude': 79.9002482, 'sheet': 'WS3'},
+    'WS4': {'latitude': 7.0198337, 'longitude': 79.9001282, 'sheet': 'WS4'},
+}
+
+
+# Function to append `count` readings per station, 35 seconds apart, from row `first` on
+def append_history(backend, first, count):
+    start = datetime(2025, 5, 1, 8, 0, 0)
+    for offset, name in enumerate(STATIONS):
+        for i in range(first, first + count):
+            stamp = start + timedelta(seconds=35 * i)
+            backend.append_reading(name, [stamp.strftime("%Y-%m-%d"), stamp.strftime("%H:%M:%S"),
+                                          f"{28 + offset + 0.01 * i:.2f}C", f"{70 - offset:.2f}%",
+                                          f"{1008 + 0.1 * offset:.2f}hPa", "Good", "Not raining"])
+
+
+def test_second_run_sees_rows_appended_after_the_first(tmp_path):
+    registry = StationRegistry(STATIONS)
+    tuner = PowerTuner(registry, LocalBackend(str(tmp_path / "data")), str(tmp_path / "idw_power.json"))
+
+    # Readings arrive through another backend, like ingest_server.py or storage.py import
+    writer = LocalBackend(str(tmp_path / "data"))
+    append_history(writer, 0, 20)
+    first = tuner.run()
+    append_history(writer, 20, 30)
+    second = tuner.run()
+
+    assert first['Temperature']['points'] == 4 * 20
+    assert second['Temperature']['points'] == 4 * 50
+
+
+def test_ties_keep_the_config_power():
+    # Every station reads the same humidity, so every power predicts it exactly
+    latitudes = [info['latitude'] for info in STATIONS.values()]
+    longitudes = [info['longitude'] for info in STATIONS.values()]
+    distances = haversine_matrix(latitudes, longitudes, latitudes, longitudes)
+    values = np.full((100, 4, 1), 70.0)
+    valid = np.ones(values.shape, dtype=bool)
+
+    for default_power in (2, 1.5, 2.1):
+        results = tune(distances, values, valid, params=['Humidity'], default_power=default_power)
+        assert results['Humidity']['power'] == default_power
+        assert results['Humidity']['rmse'] == 0.0
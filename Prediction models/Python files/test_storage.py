@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Checks of the local columnar store in storage.py.
+#
+#     python -m pytest test_storage.py
+
+import csv
+import multiprocessing
+
+import numpy as np
+
+from bulk_parser import parse_sheet_rows
+from storage import WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS, ColumnarTable, LocalBackend, import_csv, parse_timestamp
+
+
+def reading(date, time, temperature=28.5):
+    return [date, time, f"{temperature}C", "70%", "1008hPa", "Good", "Not raining"]
+
+
+# Function run in a separate process: append one row per second of its own minute
+def append_minute(directory, minute):
+    table = ColumnarTable(directory, WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    for second in range(60):
+        table.append_rows([reading("2025-05-01", f"10:{minute:02d}:{second:02d}", temperature=minute)])
+
+
+def test_processes_appending_to_one_table_agree_on_new_codes(tmp_path):
+    processes = [multiprocessing.Process(target=append_minute, args=(str(tmp_path), minute)) for minute in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # Rows from the four processes interleave; rows older than the last one
+    # stored are rejected, but every stored row keeps its own Time
+    table = ColumnarTable(str(tmp_path), WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    rows = table.read_rows(0, table.rows)
+    assert rows
+    for row in rows:
+        assert row[1].startswith(f"10:{int(float(row[2][:-1])):02d}:")
+
+
+def test_tables_sharing_a_directory_agree_on_new_codes(tmp_path):
+    # Two backends appending to the same table
+    first = ColumnarTable(str(tmp_path), WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    second = ColumnarTable(str(tmp_path), WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    first.append_rows([reading("2025-05-01", "10:00:00")])
+    second.append_rows([reading("2025-05-01", "10:00:05")])
+    first.append_rows([reading("2025-05-01", "10:00:10")])
+
+    fresh = ColumnarTable(str(tmp_path), WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    for table in (first, second, fresh):
+        assert [row[1] for row in table.read_rows(0, 10)] == ["10:00:00", "10:00:05", "10:00:10"]
+
+
+def test_rows_older_than_the_stored_ones_are_rejected(tmp_path):
+    table = ColumnarTable(str(tmp_path), WS_EXPECTED_HEADERS, WS_NUMERIC_UNITS)
+    assert table.append_rows([reading("2025-05-01", "10:00:10"), reading("2025-05-01", "10:00:00")]) == 2
+    assert table.append_rows([reading("2025-05-01", "09:59:00"), reading("2025-05-01", "10:00:20")]) == 1
+
+    timestamps = table.read_field('timestamp')
+    assert np.all(np.diff(timestamps) >= 0)
+    assert [row[1] for row in table.read_rows(0, 10)] == ["10:00:00", "10:00:10", "10:00:20"]
+    assert table.time_range(parse_timestamp("2025-05-01", "10:00:05")) == (1, 3)
+
+
+def test_csv_import_reads_12_hour_exports_like_the_row_parser(tmp_path):
+    rows = [reading("4/18/2025", f"{hour}:49:58 {half}") for half in ("AM", "PM") for hour in [12] + list(range(1, 12))]
+    rows.append(reading("not a date", "1:00:00 PM"))
+    path = tmp_path / "WS1.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(WS_EXPECTED_HEADERS)
+        writer.writerows(rows)
+
+    backend = LocalBackend(str(tmp_path / "data"))
+    assert import_csv(backend, "WS1", str(path)) == (24, 1)
+    expected = [parse_timestamp(row[0], row[1]) for row in rows[:-1]]
+    assert backend.scan("WS1")['timestamp'].tolist() == expected
+    assert not np.isnat(parse_sheet_rows(rows[:-1])['timestamp']).any()